@@ -1,21 +1,60 @@
 """配置管理模块（支持动态加载/导入设备三元组）"""
+import atexit
 import json
 import logging
 import os
+import threading
 from typing import Dict, List, Optional
 
+try:
+    import orjson  # C实现的JSON解析器（可选依赖）
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("config_manager")
 
+# 保存配置的合并窗口（秒）：窗口内的多次保存只落盘一次
+SAVE_DEBOUNCE_SECONDS = 0.5
+
+# has_config_changed每调用这么多次重新探测一次配置文件是否存在（发现启动后新建的文件）
+CONFIG_REPROBE_INTERVAL = 10
+
+
+def _loads(data):
+    """解析JSON（优先使用orjson，不可用时回退到标准库）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    """序列化为带缩进的UTF-8 JSON字节串（与json.dump(indent=2, ensure_ascii=False)输出等价）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
 class ConfigManager:
     """配置管理器"""
     def __init__(self):
         self.config = {}
+        self._parse_cache = {}  # 已解析文件的签名缓存 {path: (st_mtime_ns, st_size)}
+        # 延迟保存状态
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._flush_timer = None
+        self._last_written = None  # 上次写入的内容，内容不变时跳过写入
+        self._enabled_cache = None  # 启用设备列表缓存（配置变更时失效）
+        self._device_index = None  # 启用设备索引 {device_id: device}（配置变更时失效）
+        self._existing_config_files = None  # 已存在的配置文件列表（has_config_changed使用）
+        self._config_check_count = 0
         # 根据环境选择配置路径
         if os.path.exists("/data") and os.access("/data", os.W_OK):
             self.config_path = "/data/config.json"  # HA Add-on持久化目录
         else:
             self.config_path = "config_local.json"  # 本地开发环境
         self._ensure_config_dir()
+        atexit.register(self._flush)  # 进程退出前确保待保存的配置落盘
 
     def _ensure_config_dir(self):
         """确保配置目录存在"""
@@ -26,6 +65,20 @@ class ConfigManager:
         except (OSError, PermissionError) as e:
             logger.warning(f"无法创建配置目录: {e}")
 
+    def _invalidate(self):
+        """配置内容变更后调用，使派生缓存失效"""
+        self._enabled_cache = None
+        self._device_index = None
+
+    @staticmethod
+    def _file_signature(path: str) -> Optional[tuple]:
+        """获取文件签名（纳秒级mtime+大小），文件不存在时返回None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
     def load_from_env(self) -> Dict:
         """从环境变量加载配置（HA Add-on传递）"""
         try:
@@ -44,7 +97,8 @@ class ConfigManager:
                     "mqtt_config": {
                         "host": bashio.config.get("mqtt_host"),
                         "port": int(bashio.config.get("mqtt_port")),
-                        "keepalive": 60
+                        "keepalive": 60,
+                        "always_push_keys": bashio.config.get("always_push_keys", ["energy"])
                     },
                     "report_interval": int(bashio.config.get("report_interval")),
                     "discovery_retry_interval": int(bashio.config.get("discovery_retry_interval")),
@@ -52,6 +106,7 @@ class ConfigManager:
                     "retry_delay": int(bashio.config.get("retry_delay"))
                 }
                 self.config = config
+                self._invalidate()
                 self.save_config()
                 logger.info("配置从HA Add-on加载成功")
                 return config
@@ -70,10 +125,15 @@ class ConfigManager:
         
         for options_path in options_paths:
             try:
-                if os.path.exists(options_path):
+                signature = self._file_signature(options_path)
+                if signature is not None:
+                    # 文件自上次解析后未变更，直接返回缓存配置（跳过解析和回写）
+                    if self.config and self._parse_cache.get(options_path) == signature:
+                        logger.debug("配置文件 %s 未变更，使用缓存配置", options_path)
+                        return self.config
                     logger.info(f"找到配置文件: {options_path}")
-                    with open(options_path, "r", encoding="utf-8") as f:
-                        options = json.load(f)
+                    with open(options_path, "rb") as f:
+                        options = _loads(f.read())
                     config = {
                         "ha_url": options.get("ha_url", "http://10.222.36.124:8123/api"),
                         "ha_token": options.get("ha_token", ""),
@@ -82,7 +142,8 @@ class ConfigManager:
                         "mqtt_config": {
                             "host": options.get("mqtt_host", "device.iot.163.com"),
                             "port": int(options.get("mqtt_port", 1883)),
-                            "keepalive": 60
+                            "keepalive": 60,
+                            "always_push_keys": options.get("always_push_keys", ["energy"])
                         },
                         "report_interval": int(options.get("report_interval", 60)),
                         "discovery_retry_interval": int(options.get("discovery_retry_interval", 300)),
@@ -90,6 +151,8 @@ class ConfigManager:
                         "retry_delay": int(options.get("retry_delay", 3))
                     }
                     self.config = config
+                    self._invalidate()
+                    self._parse_cache[options_path] = signature
                     self.save_config()
                     logger.info("配置从options.json加载成功")
                     return config
@@ -113,15 +176,23 @@ class ConfigManager:
             logger.info("检测到HA Add-on环境，使用内部API地址")
         
         self.config = config
+        self._invalidate()
         logger.warning("使用默认配置（请在 Add-on 配置中填写必要信息）")
         return config
 
     def load_saved_config(self) -> Dict:
         """加载本地保存的配置"""
         try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path, "r", encoding="utf-8") as f:
-                    self.config = json.load(f)
+            self._flush()  # 先落盘尚未写入的修改，避免读到旧文件
+            signature = self._file_signature(self.config_path)
+            if signature is not None:
+                if self.config and self._parse_cache.get(self.config_path) == signature:
+                    logger.debug("本地配置文件未变更，使用缓存配置")
+                    return self.config
+                with open(self.config_path, "rb") as f:
+                    self.config = _loads(f.read())
+                self._invalidate()
+                self._parse_cache[self.config_path] = signature
                 logger.info("配置从本地文件加载成功")
                 return self.config
         except Exception as e:
@@ -129,18 +200,54 @@ class ConfigManager:
         return self.get_default_config()
 
     def save_config(self):
-        """保存配置到本地"""
-        try:
-            with open(self.config_path, "w", encoding="utf-8") as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
-            logger.info("配置已保存到本地")
-        except Exception as e:
-            logger.error(f"保存配置失败: {str(e)}")
+        """保存配置到本地（短时间内的多次保存合并为一次写入）"""
+        with self._save_lock:
+            self._dirty = True
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """启动延迟写入定时器（已有待执行的定时器时不重复启动，需持有_save_lock）"""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self):
+        """将待保存的配置写入磁盘（写临时文件并fsync后原子替换，读取方不会看到半写文件）
+
+        进程通过os.execv/os._exit重启时不会执行atexit，调用方需在此之前显式调用。
+        """
+        with self._save_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                data = _dumps(self.config)
+                if data == self._last_written:
+                    logger.debug("配置内容未变化，跳过写入")
+                    return
+                tmp_path = f"{self.config_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                    # 替换前先落盘，避免掉电后留下空的配置文件
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.config_path)
+                self._last_written = data
+                # 记录自身写入后的签名，避免下次加载时重复解析
+                self._parse_cache[self.config_path] = self._file_signature(self.config_path)
+                logger.info("配置已保存到本地")
+            except Exception as e:
+                logger.error(f"保存配置失败: {str(e)}")
 
     def import_config(self, import_data: str) -> bool:
         """导入配置（JSON字符串）"""
         try:
-            import_config = json.loads(import_data)
+            # orjson.JSONDecodeError 继承自 json.JSONDecodeError，下方异常处理保持不变
+            import_config = _loads(import_data)
             # 验证配置结构
             required_fields = ["gateway_triple", "devices_triple"]
             for field in required_fields:
@@ -149,6 +256,7 @@ class ConfigManager:
                     return False
             
             self.config.update(import_config)
+            self._invalidate()
             self.save_config()
             logger.info("配置导入成功")
             return True
@@ -160,15 +268,24 @@ class ConfigManager:
             return False
 
     def get_device_triple(self, device_id: str) -> Optional[Dict]:
-        """获取指定设备的三元组"""
-        for device in self.config.get("devices_triple", []):
-            if device.get("device_id") == device_id and device.get("enabled", True):
-                return device
-        return None
+        """获取指定设备的三元组（返回副本）"""
+        if self._device_index is None:
+            index = {}
+            for device in self._enabled_devices():
+                index.setdefault(device.get("device_id"), device)
+            self._device_index = index
+        device = self._device_index.get(device_id)
+        return dict(device) if device is not None else None
 
     def get_all_enabled_devices(self) -> List[Dict]:
-        """获取所有启用的设备"""
-        return [d for d in self.config.get("devices_triple", []) if d.get("enabled", True)]
+        """获取所有启用的设备（返回副本，调用方修改不会影响缓存和配置）"""
+        return [dict(d) for d in self._enabled_devices()]
+
+    def _enabled_devices(self) -> List[Dict]:
+        """启用设备列表缓存（缓存至下次配置变更）"""
+        if self._enabled_cache is None:
+            self._enabled_cache = [d for d in self.config.get("devices_triple", []) if d.get("enabled", True)]
+        return self._enabled_cache
 
     def reload_config(self) -> Optional[Dict]:
         """重新加载配置（用于动态发现）"""
@@ -187,18 +304,25 @@ class ConfigManager:
     def has_config_changed(self, last_check_time: float) -> bool:
         """检查配置是否已变更（基于文件修改时间）"""
         try:
-            # 检查多个可能的配置文件
-            config_files = ["/data/options.json", "/config/options.json", self.config_path]
-            
-            for config_file in config_files:
-                if os.path.exists(config_file):
-                    mtime = os.path.getmtime(config_file)
-                    if mtime > last_check_time:
-                        logger.debug(f"配置文件 {config_file} 已更新")
-                        return True
+            # 检查多个可能的配置文件（只对已存在的文件stat，定期重新探测）
+            self._config_check_count += 1
+            if (self._existing_config_files is None
+                    or not self._existing_config_files
+                    or self._config_check_count % CONFIG_REPROBE_INTERVAL == 0):
+                config_files = ["/data/options.json", "/config/options.json", self.config_path]
+                self._existing_config_files = [p for p in config_files if os.path.exists(p)]
+
+            for config_file in self._existing_config_files:
+                try:
+                    mtime = os.stat(config_file).st_mtime
+                except FileNotFoundError:
+                    continue
+                if mtime > last_check_time:
+                    logger.debug("配置文件 %s 已更新", config_file)
+                    return True
             return False
         except Exception as e:
-            logger.debug(f"检查配置变更异常: {str(e)}")
+            logger.debug("检查配置变更异常: %s", e)
             return False
 
     def update_device_triple(self, device_id: str, new_config: Dict) -> bool:
@@ -208,6 +332,7 @@ class ConfigManager:
             if device.get("device_id") == device_id:
                 devices[i].update(new_config)
                 self.config["devices_triple"] = devices
+                self._invalidate()
                 self.save_config()
                 logger.info(f"设备{device_id}配置已更新")
                 return True
@@ -218,6 +343,7 @@ class ConfigManager:
         """更新网关三元组"""
         try:
             self.config["gateway_triple"].update(new_config)
+            self._invalidate()
             self.save_config()
             logger.info("网关三元组已更新")
             return True
@@ -248,7 +374,8 @@ class ConfigManager:
             "mqtt_config": {
                 "host": "device.iot.163.com",
                 "port": 1883,
-                "keepalive": 60
+                "keepalive": 60,
+                "always_push_keys": ["energy"]
             },
             "report_interval": 60,
             "discovery_retry_interval": 300,
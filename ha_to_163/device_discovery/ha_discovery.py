@@ -1,36 +1,195 @@
 """HA实体发现（容错优化版）"""
+import functools
+import json
+import random
+import re
 import requests
 import time
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from ha_session import make_ha_session
 from .base_discovery import BaseDiscovery
+from .property_mappings import KEYWORD_MAPPING, PROPERTY_MAPPING
+
+try:
+    import orjson  # C实现的JSON解析器（可选依赖）
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # 流式JSON解析（可选依赖）
+except ImportError:
+    ijson = None
+
+try:
+    import ahocorasick  # pyahocorasick多模式匹配（可选依赖）
+except ImportError:
+    ahocorasick = None
+
+# 参与发现的实体域
+DISCOVERY_DOMAINS = frozenset(("sensor", "switch", "select"))
+
+# 特征字段定位用的已知关键词（模块加载时构建一次）
+_KNOWN_KEYWORDS = tuple(KEYWORD_MAPPING) + tuple(PROPERTY_MAPPING)
+
+# 部分匹配兜底：按长度降序排列，保证最长的键优先命中
+_PROPERTY_KEYS_BY_LENGTH = tuple(sorted(PROPERTY_MAPPING, key=len, reverse=True))
+
+
+def _build_property_automaton():
+    """用PROPERTY_MAPPING的键构建Aho-Corasick自动机（未安装pyahocorasick时返回None）"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for key, property_name in PROPERTY_MAPPING.items():
+        automaton.add_word(key, (len(key), property_name))
+    automaton.make_automaton()
+    return automaton
+
+
+_PROPERTY_AUTOMATON = _build_property_automaton()
+
+
+def _build_prefix_automaton(prefixes):
+    """用设备前缀构建Aho-Corasick自动机（未安装pyahocorasick或存在空前缀时返回None）"""
+    if ahocorasick is None or not all(prefixes):
+        return None
+    automaton = ahocorasick.Automaton()
+    for prefix in prefixes:
+        automaton.add_word(prefix, prefix)
+    automaton.make_automaton()
+    return automaton
+
+
+def _loads(data):
+    """解析JSON（优先使用orjson，不可用时回退到标准库）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _iter_states(resp):
+    """逐个产出/states响应中的实体
+
+    安装了ijson时直接从响应流中逐个解析（需以stream=True请求），内存占用与实体总数无关；
+    否则整体解析响应体。
+    """
+    if ijson is not None:
+        resp.raw.decode_content = True  # 由urllib3透明解压gzip等编码
+        return ijson.items(resp.raw, "item")
+    return _loads(resp.content)
+
+
+def _project_states(resp) -> Tuple[tuple, tuple, tuple, tuple]:
+    """解析/states响应，只保留参与发现域的实体，按列返回(ids, domains, cores, states)
+
+    解析出的实体字典（含attributes/context等）不会被保留。
+    """
+    ids, domains, cores, states = [], [], [], []
+    for entity in _iter_states(resp):
+        entity_id = entity.get("entity_id", "")
+        domain, _, core = entity_id.partition(".")
+        if domain in DISCOVERY_DOMAINS:
+            ids.append(entity_id)
+            domains.append(domain)
+            cores.append(core)
+            states.append(entity.get("state"))
+    return tuple(ids), tuple(domains), tuple(cores), tuple(states)
+
+
+class _EntitySnapshot(NamedTuple):
+    """一次加载得到的参与发现域的实体（列式存储，同一下标对应同一实体）及其分词索引
+
+    各列与索引只能通过from_columns一起构建，加载时整体替换，读取方不会看到不一致的组合。
+    """
+    ids: tuple
+    domains: tuple
+    cores: tuple
+    index: Dict[str, List[int]]  # 分词索引 {token: [实体下标]}
+
+    @classmethod
+    def from_columns(cls, ids: tuple, domains: tuple, cores: tuple) -> "_EntitySnapshot":
+        """由实体列构建快照（分词索引每次加载构建一次，供各设备发现复用）"""
+        index = {}
+        for i, core in enumerate(cores):
+            for token in set(core.split("_")):
+                index.setdefault(token, []).append(i)
+        return cls(ids, domains, cores, index)
+
+    def candidates(self, prefix: str) -> Sequence[int]:
+        """根据前缀从索引中取候选实体下标
+
+        前缀作为子串出现在entity_core中时，其中间分词必然是entity_core的完整分词，
+        因此取中间分词中桶最小的一个即可精确缩小范围；前缀不足3段时退回全量列表。
+        """
+        inner_tokens = prefix.split("_")[1:-1]
+        if not inner_tokens:
+            return range(len(self.cores))
+        return min((self.index.get(token, ()) for token in inner_tokens), key=len)
+
+
+_EMPTY_SNAPSHOT = _EntitySnapshot.from_columns((), (), ())
+
+
+def _match_partial_property(feature: str) -> Optional[str]:
+    """部分匹配：返回feature中包含的最长PROPERTY_MAPPING键对应的属性名"""
+    if _PROPERTY_AUTOMATON is not None:
+        # 单次扫描feature找出所有命中的键，取最长者
+        best = max(_PROPERTY_AUTOMATON.iter(feature), key=lambda item: item[1][0], default=None)
+        return best[1][1] if best else None
+    for key in _PROPERTY_KEYS_BY_LENGTH:
+        if key in feature:
+            return PROPERTY_MAPPING[key]
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_property(suffix: str, supported: frozenset) -> Optional[str]:
+    """由实体前缀之后的部分解析IoT属性名，不在supported中时返回None
+
+    结果按(suffix, supported)缓存（映射表为只读，缓存无需失效）。
+    """
+    # 移除设备标识符部分（如_pw6u1_）
+    # 特征字段应该以已知的属性关键词开头
+    feature_parts = suffix.strip("_").split("_")
+
+    # 找到第一个属性关键词的位置
+    feature_start_idx = 0
+    for i, part in enumerate(feature_parts):
+        # 检查从当前位置开始的组合是否匹配已知关键词
+        for j in range(i + 1, len(feature_parts) + 1):
+            combined = "_".join(feature_parts[i:j])
+            if any(combined.startswith(kw) or kw.startswith(combined) for kw in _KNOWN_KEYWORDS):
+                feature_start_idx = i
+                break
+        else:
+            continue
+        break
+
+    feature = "_".join(feature_parts[feature_start_idx:])
+    if not feature:
+        return None
+
+    # 匹配属性 - 修复：简化的关键字匹配策略
+    property_name = None
+
+    # 1. 首先检查精确匹配（PROPERTY_MAPPING）
+    if feature in PROPERTY_MAPPING:
+        property_name = PROPERTY_MAPPING[feature]
+    else:
+        # 2. 检查关键字匹配（KEYWORD_MAPPING）- 匹配关键字段，忽略后缀
+        for keyword, mapped_name in KEYWORD_MAPPING.items():
+            if feature.startswith(keyword):
+                property_name = mapped_name
+                break
+
+        # 3. 如果仍未匹配，检查部分匹配（最长键优先）
+        if not property_name:
+            property_name = _match_partial_property(feature)
+
+    # 验证是否为设备支持的属性
+    return property_name if property_name in supported else None
 
-# 属性映射（使用IoT原生参数名，避免双重转换）
-PROPERTY_MAPPING = {
-    # 标准开关插座属性映射（精确匹配）
-    "child_lock_p_14_9": "child_lock",
-    "switch_status_p_10_1": "switch_status",
-    "toggle_a_2_1": "toggle",
-    "on_p_2_1": "state0",      # 总开关 → state0
-    "on_p_7_1": "state1",      # 插口1 → state1
-    "on_p_8_1": "state2",      # 插口2 → state2
-    "on_p_9_1": "state3",      # 插口3 → state3
-    "on_p_10_1": "state4",     # 插口4 → state4
-    "on_p_11_1": "state5",     # 插口5 → state5
-    "on_p_12_1": "state6",     # 插口6 → state6
-    "default_power_on_state_p_2_2": "default",
-    "power_consumption_accumulation_way_p_3_3": "power_consumption_accumulation_way",
-    "indicator_light_p_2_4": "indicator_light",
-}
-
-# 关键字段匹配（只匹配前缀，忽略后面的参数编号）
-KEYWORD_MAPPING = {
-    "electric_power": "active_power",        # 匹配所有 electric_power_*
-    "electric_current": "current",           # 匹配所有 electric_current_*
-    "voltage": "voltage",                    # 匹配所有 voltage_*
-    "power_consumption": "energy",           # 匹配所有 power_consumption_*
-    "default_power_on_state": "default",     # 匹配所有 default_power_on_state_*
-}
 
 class HADiscovery(BaseDiscovery):
     """HA实体发现类（容错优化）"""
@@ -38,63 +197,92 @@ class HADiscovery(BaseDiscovery):
         super().__init__(config, "ha_discovery")
         self.ha_url = config.get("ha_url")
         self.ha_headers = ha_headers
-        self.entities = []
+        self._session = make_ha_session(self.ha_url, ha_headers)
+        # 参与发现域的实体快照（加载时整体替换，读取方先取本地引用，保证各列与索引来自同一次加载）
+        self._entities = _EMPTY_SNAPSHOT
+        self._entity_states = {}  # 实体状态快照 {entity_id: state}
         self.failed_devices = {}  # 记录发现失败的设备 {device_id: last_attempt_time}
         self.discovered_devices = {}  # 已发现的设备 {device_id: sensor_map}
 
     def load_ha_entities(self) -> bool:
         """加载HA实体列表（容错优化）"""
         try:
-            ha_api_url = self.ha_url if self.ha_url.endswith("/") else f"{self.ha_url}/"
             resp = None
+            retry_attempts = self.config.get("retry_attempts", 5)
+            retry_delay = self.config.get("retry_delay", 3)
 
-            for attempt in range(self.config.get("retry_attempts", 5)):
+            for attempt in range(retry_attempts):
                 try:
-                    resp = requests.get(
-                        f"{ha_api_url}states",
-                        headers=self.ha_headers,
-                        timeout=10,
-                        verify=False
-                    )
+                    resp = self._get_states()
                     resp.raise_for_status()
                     break
                 except requests.exceptions.RequestException as e:
+                    # 失败的流式响应未被读取，需主动关闭以归还连接
+                    if resp is not None:
+                        resp.close()
+                        resp = None
                     self.logger.warning(f"加载实体失败（{attempt+1}）: {str(e)}")
-                    time.sleep(self.config.get("retry_delay", 3))
-
-            if not resp or resp.status_code != 200:
-                self.logger.error(f"HA API响应异常: {resp.status_code if resp else '无响应'}")
+                    if attempt == retry_attempts - 1:
+                        break  # 最后一次失败不再等待
+                    # 指数退避+随机抖动，避免多个实例同步重试
+                    time.sleep(retry_delay * (1 << attempt) * random.uniform(0.5, 1.5))
+
+            if resp is None or resp.status_code != 200:
+                self.logger.error(f"HA API响应异常: {resp.status_code if resp is not None else '无响应'}")
+                if resp is not None:
+                    resp.close()
                 return False
 
-            self.entities = resp.json()
-            self.logger.info(f"成功加载{len(self.entities)}个HA实体")
+            with resp:
+                ids, domains, cores, states = _project_states(resp)
+            self._entities = _EntitySnapshot.from_columns(ids, domains, cores)
+            self._entity_states = dict(zip(ids, states))
+            self.logger.info(f"成功加载{len(ids)}个HA实体（sensor/switch/select）")
             return True
 
         except Exception as e:
             self.logger.error(f"加载实体失败: {str(e)}", exc_info=True)
             return False
 
-    def read_entity_value_safe(self, entity_id: str) -> Optional[any]:
+    @property
+    def _states_url(self) -> str:
+        """HA /states接口地址（按需拼接，未配置ha_url时初始化不报错，由请求阶段按失败处理）"""
+        return f"{(self.ha_url or '').rstrip('/')}/states"
+
+    def _get_states(self):
+        """请求全量实体状态（可流式解析时以stream方式请求，避免整体缓存响应体）"""
+        return self._session.get(self._states_url, timeout=10, stream=ijson is not None)
+
+    def refresh_entity_snapshot(self) -> bool:
+        """拉取一次全量实体状态快照（每个推送周期调用一次，代替逐实体请求）"""
+        try:
+            with self._get_states() as resp:
+                resp.raise_for_status()
+                ids, _, _, states = _project_states(resp)
+            self._entity_states = dict(zip(ids, states))
+            return True
+        except Exception as e:
+            self.logger.warning(f"刷新实体状态快照失败，改为逐个读取: {str(e)}")
+            self._entity_states = {}
+            return False
+
+    def read_entity_value_safe(self, entity_id: str, force_refresh: bool = False) -> Optional[any]:
         """安全读取实体值（单个实体失败不影响）"""
         try:
-            return self.read_entity_value(entity_id)
+            return self.read_entity_value(entity_id, force_refresh)
         except Exception as e:
             self.logger.warning(f"读取实体{entity_id}失败（跳过）: {str(e)}")
             return None
 
-    def read_entity_value(self, entity_id: str) -> any:
-        """读取HA实体值"""
+    def read_entity_value(self, entity_id: str, force_refresh: bool = False) -> any:
+        """读取HA实体值（优先使用状态快照，force_refresh=True或快照中不存在时请求HA）"""
         try:
-            ha_api_url = self.ha_url if self.ha_url.endswith("/") else f"{self.ha_url}/"
-            resp = requests.get(
-                f"{ha_api_url}states/{entity_id}",
-                headers=self.ha_headers,
-                timeout=5,
-                verify=False
-            )
-            resp.raise_for_status()
-            entity_data = resp.json()
-            state = entity_data.get("state")
+            if not force_refresh and entity_id in self._entity_states:
+                state = self._entity_states[entity_id]
+            else:
+                resp = self._session.get(f"{self._states_url}/{entity_id}", timeout=5)
+                resp.raise_for_status()
+                state = _loads(resp.content).get("state")
 
             if state in ("unknown", "unavailable", ""):
                 return None
@@ -115,8 +303,77 @@ class HADiscovery(BaseDiscovery):
         except Exception as e:
             raise e  # 抛出异常由上层处理
 
+    def _match_prefix(self, prefix: str) -> List[Tuple[str, str]]:
+        """取出包含前缀的实体，返回[(entity_id, 前缀之后的部分)]（保持原实体顺序）"""
+        entities = self._entities
+        ids, cores = entities.ids, entities.cores
+        return [
+            (ids[i], cores[i].partition(prefix)[2])
+            for i in entities.candidates(prefix)
+            if prefix in cores[i]
+        ]
+
+    def _match_prefixes(self, prefixes) -> Dict[str, List[Tuple[str, str]]]:
+        """单次遍历全部实体，同时匹配多个前缀，按前缀分组返回匹配结果
+
+        结果与逐个前缀调用_match_prefix一致：实体同时包含多个前缀（包括一个前缀包含另一个）时，
+        归入每个匹配的前缀，前缀之后的部分按该前缀首次出现的位置截取。
+        安装了pyahocorasick时用自动机一次扫描找出全部命中的前缀；
+        否则先用一条正则筛掉不含任何前缀的实体，命中的实体再逐个前缀确认。
+        """
+        prefixes = tuple(prefixes)
+        matches = {prefix: [] for prefix in prefixes}
+        entities = self._entities
+        ids, cores = entities.ids, entities.cores
+        automaton = _build_prefix_automaton(prefixes)
+        if automaton is not None:
+            for i, core in enumerate(cores):
+                # iter按结束位置递增产出，同一前缀第一次命中即为首次出现的位置
+                first_end = {}
+                for end, prefix in automaton.iter(core):
+                    first_end.setdefault(prefix, end)
+                for prefix, end in first_end.items():
+                    matches[prefix].append((ids[i], core[end + 1:]))
+            return matches
+
+        pattern = re.compile("|".join(map(re.escape, prefixes)))
+        for i, core in enumerate(cores):
+            if pattern.search(core):
+                for prefix in prefixes:
+                    if prefix in core:
+                        matches[prefix].append((ids[i], core.partition(prefix)[2]))
+        return matches
+
     def discover_single_device(self, device_config: Dict) -> Optional[Dict]:
         """发现单个设备（容错：单个失败不影响其他）"""
+        try:
+            matches = self._match_prefix(device_config["entity_prefix"])
+        except Exception as e:
+            self.logger.error(f"发现设备{device_config['device_id']}失败（跳过）: {str(e)}")
+            self.failed_devices[device_config["device_id"]] = time.time()
+            return None
+        return self._discover_from_matches(device_config, matches)
+
+    def _discover_from_matches(self, device_config: Dict, matches: List[Tuple[str, str]]) -> Optional[Dict]:
+        """根据前缀匹配结果构建设备的属性→实体映射，并更新发现/失败记录"""
+        device_result = self._build_device_result(device_config, matches)
+        self._record_results([device_result] if device_result else [],
+                             [] if device_result else [device_config["device_id"]])
+        return device_result
+
+    def _record_results(self, results: List[Dict], failed_ids: List[str]):
+        """将一批发现结果一次性合并进发现/失败记录"""
+        now = time.time()
+        for device_result in results:
+            device_id = device_result["device_id"]
+            self.discovered_devices[device_id] = device_result
+            # 从失败列表移除
+            self.failed_devices.pop(device_id, None)
+        for device_id in failed_ids:
+            self.failed_devices[device_id] = now
+
+    def _build_device_result(self, device_config: Dict, matches: List[Tuple[str, str]]) -> Optional[Dict]:
+        """根据前缀匹配结果构建设备结果（不修改共享状态），未匹配到实体或出错时返回None"""
         device_id = device_config["device_id"]
         prefix = device_config["entity_prefix"]
         supported_props = device_config.get("supported_properties", [])
@@ -126,86 +383,20 @@ class HADiscovery(BaseDiscovery):
             self.logger.info(f"  [调试] 支持的属性: {supported_props}")
             sensor_map = {}
 
-            # 调试：先统计一下匹配前缀的实体
-            prefix_matching_entities = []
-            for entity in self.entities:
-                entity_id = entity.get("entity_id", "")
-                entity_core = entity_id.split(".", 1)[1] if "." in entity_id else ""
-                if prefix in entity_core:
-                    prefix_matching_entities.append(entity_id)
-
-            if prefix_matching_entities:
-                self.logger.info(f"  [调试] 前缀 '{prefix}' 匹配到 {len(prefix_matching_entities)} 个实体:")
-                for eid in prefix_matching_entities:
+            if matches:
+                self.logger.info(f"  [调试] 前缀 '{prefix}' 匹配到 {len(matches)} 个实体:")
+                for eid, _ in matches:
                     self.logger.info(f"    - {eid}")
             else:
                 self.logger.warning(f"  [调试] 前缀 '{prefix}' 未匹配到任何实体!")
 
             # 遍历实体匹配当前设备
-            for entity in self.entities:
-                entity_id = entity.get("entity_id", "")
-                if not entity_id.startswith(("sensor.", "switch.", "select.")):
-                    continue
-
-                entity_core = entity_id.split(".", 1)[1] if "." in entity_id else ""
-                if prefix not in entity_core:
-                    continue
-
-                # 提取特征字段（修复：正确处理不同格式的prefix）
-                # 找到prefix在entity_core中的位置，提取后面的部分
-                prefix_pos = entity_core.find(prefix)
-                if prefix_pos == -1:
-                    continue
-
-                # 从prefix结束位置开始提取，跳过中间的设备标识符（如pw6u1）
-                after_prefix = entity_core[prefix_pos + len(prefix):]
-
-                # 移除设备标识符部分（如_pw6u1_）
-                # 特征字段应该以已知的属性关键词开头
-                feature_parts = after_prefix.strip("_").split("_")
-
-                # 找到第一个属性关键词的位置
-                feature_start_idx = 0
-                known_keywords = list(KEYWORD_MAPPING.keys()) + list(PROPERTY_MAPPING.keys())
-                for i, part in enumerate(feature_parts):
-                    # 检查从当前位置开始的组合是否匹配已知关键词
-                    for j in range(i + 1, len(feature_parts) + 1):
-                        combined = "_".join(feature_parts[i:j])
-                        if any(combined.startswith(kw) or kw.startswith(combined) for kw in known_keywords):
-                            feature_start_idx = i
-                            break
-                    else:
-                        continue
-                    break
-
-                feature = "_".join(feature_parts[feature_start_idx:])
-                if not feature:
-                    continue
-
-                # 匹配属性 - 修复：简化的关键字匹配策略
-                property_name = None
-
-                # 1. 首先检查精确匹配（PROPERTY_MAPPING）
-                if feature in PROPERTY_MAPPING:
-                    property_name = PROPERTY_MAPPING[feature]
-                else:
-                    # 2. 检查关键字匹配（KEYWORD_MAPPING）- 匹配关键字段，忽略后缀
-                    for keyword, mapped_name in KEYWORD_MAPPING.items():
-                        if feature.startswith(keyword):
-                            property_name = mapped_name
-                            break
-
-                    # 3. 如果仍未匹配，检查部分匹配
-                    if not property_name:
-                        for key in PROPERTY_MAPPING:
-                            if key in feature:
-                                property_name = PROPERTY_MAPPING[key]
-                                break
-
-                # 验证并保存
-                if property_name and property_name in supported_props:
+            supported = frozenset(supported_props)
+            for entity_id, after_prefix in matches:
+                property_name = _resolve_property(after_prefix, supported)
+                if property_name:
                     sensor_map[property_name] = entity_id
-                    self.logger.debug(f"设备{device_id}匹配到: {entity_id} → {property_name}")
+                    self.logger.debug("设备%s匹配到: %s → %s", device_id, entity_id, property_name)
 
             if sensor_map:
                 self.logger.info(f"设备{device_id}发现成功，匹配到{len(sensor_map)}个实体")
@@ -218,41 +409,74 @@ class HADiscovery(BaseDiscovery):
                     "config": device_config,
                     "sensors": sensor_map
                 }
-                self.discovered_devices[device_id] = device_result
-                # 从失败列表移除
-                if device_id in self.failed_devices:
-                    del self.failed_devices[device_id]
                 return device_result
             else:
                 self.logger.warning(f"设备{device_id}未匹配到任何实体")
-                self.failed_devices[device_id] = time.time()
                 return None
 
         except Exception as e:
             self.logger.error(f"发现设备{device_id}失败（跳过）: {str(e)}")
-            self.failed_devices[device_id] = time.time()
             return None
 
+    def _discover_batch(self, device_configs: List[Dict]) -> Dict:
+        """发现一批已启用的设备，返回 {device_id: device_result}
+
+        多个设备时先收集全部entity_prefix，单次遍历实体完成全部前缀匹配再分发给各设备，
+        耗时只与实体数量线性相关；单个设备直接走分词索引。
+        entity_prefix缺失或不是字符串的设备单独记为失败，不影响同批其他设备。
+        各设备的结果先收集起来，最后一次性合并进发现/失败记录。
+        """
+        if len(device_configs) <= 1:
+            matched_devices = {}
+            for device_config in device_configs:
+                device_result = self.discover_single_device(device_config)
+                if device_result:
+                    matched_devices[device_config["device_id"]] = device_result
+            return matched_devices
+
+        # 先逐个校验前缀，无效前缀的设备直接记为失败，不参与批量匹配
+        valid_configs = []
+        failed_ids = []
+        prefixes = set()
+        for device_config in device_configs:
+            prefix = device_config.get("entity_prefix")
+            if isinstance(prefix, str):
+                valid_configs.append(device_config)
+                prefixes.add(prefix)
+            else:
+                self.logger.error(f"发现设备{device_config['device_id']}失败（跳过）: 无效的entity_prefix: {prefix!r}")
+                failed_ids.append(device_config["device_id"])
+        matches_by_prefix = self._match_prefixes(prefixes)
+
+        # 逐个处理设备（单个失败不影响）
+        matched_devices = {}
+        for device_config in valid_configs:
+            device_id = device_config["device_id"]
+            device_result = self._build_device_result(
+                device_config, matches_by_prefix[device_config["entity_prefix"]]
+            )
+            if device_result:
+                matched_devices[device_id] = device_result
+            else:
+                failed_ids.append(device_id)
+        self._record_results(list(matched_devices.values()), failed_ids)
+        return matched_devices
+
     def discover_all_devices(self, device_configs: List[Dict]) -> Dict:
         """发现所有设备（容错优化）"""
-        matched_devices = {}
-        
         # 先加载实体列表
         if not self.load_ha_entities():
             self.logger.error("实体列表加载失败，使用缓存的发现结果")
             return self.discovered_devices
 
-        # 逐个发现设备（单个失败不影响）
+        enabled_configs = []
         for device_config in device_configs:
-            device_id = device_config["device_id"]
             if not device_config.get("enabled", True):
-                self.logger.info(f"设备{device_id}已禁用，跳过发现")
+                self.logger.info(f"设备{device_config['device_id']}已禁用，跳过发现")
                 continue
-            
-            device_result = self.discover_single_device(device_config)
-            if device_result:
-                matched_devices[device_id] = device_result
+            enabled_configs.append(device_config)
 
+        matched_devices = self._discover_batch(enabled_configs)
         self.logger.info(f"批量发现完成，成功发现{len(matched_devices)}个设备，失败{len(self.failed_devices)}个")
         return matched_devices
 
@@ -260,25 +484,23 @@ class HADiscovery(BaseDiscovery):
         """重试发现失败的设备"""
         now = time.time()
         retry_devices = []
-        
+
+        # 按device_id建立启用设备的索引，避免逐个失败设备线性查找
+        config_by_id = {}
+        for config in device_configs:
+            if config.get("enabled", True):
+                config_by_id.setdefault(config["device_id"], config)
+
         # 筛选需要重试的设备
         for device_id, last_attempt in self.failed_devices.items():
-            if now - last_attempt >= retry_interval:
-                # 找到设备配置
-                for config in device_configs:
-                    if config["device_id"] == device_id and config.get("enabled", True):
-                        retry_devices.append(config)
-                        break
+            if now - last_attempt >= retry_interval and device_id in config_by_id:
+                retry_devices.append(config_by_id[device_id])
 
         if not retry_devices:
             return {}
 
         self.logger.info(f"开始重试发现{len(retry_devices)}个失败设备")
-        retry_results = {}
-        for device_config in retry_devices:
-            result = self.discover_single_device(device_config)
-            if result:
-                retry_results[device_config["device_id"]] = result
+        retry_results = self._discover_batch(retry_devices)
 
         self.logger.info(f"重试完成，成功恢复{len(retry_results)}个设备")
         return retry_results
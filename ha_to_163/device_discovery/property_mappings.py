@@ -0,0 +1,39 @@
+"""实体特征字段→IoT属性名映射表"""
+import sys
+from types import MappingProxyType
+
+# 属性映射（使用IoT原生参数名，避免双重转换）
+_PROPERTY_MAPPING_RAW = {
+    # 标准开关插座属性映射（精确匹配）
+    "child_lock_p_14_9": "child_lock",
+    "switch_status_p_10_1": "switch_status",
+    "toggle_a_2_1": "toggle",
+    "on_p_2_1": "state0",      # 总开关 → state0
+    "on_p_7_1": "state1",      # 插口1 → state1
+    "on_p_8_1": "state2",      # 插口2 → state2
+    "on_p_9_1": "state3",      # 插口3 → state3
+    "on_p_10_1": "state4",     # 插口4 → state4
+    "on_p_11_1": "state5",     # 插口5 → state5
+    "on_p_12_1": "state6",     # 插口6 → state6
+    "default_power_on_state_p_2_2": "default",
+    "power_consumption_accumulation_way_p_3_3": "power_consumption_accumulation_way",
+    "indicator_light_p_2_4": "indicator_light",
+}
+
+# 关键字段匹配（只匹配前缀，忽略后面的参数编号）
+_KEYWORD_MAPPING_RAW = {
+    "electric_power": "active_power",        # 匹配所有 electric_power_*
+    "electric_current": "current",           # 匹配所有 electric_current_*
+    "voltage": "voltage",                    # 匹配所有 voltage_*
+    "power_consumption": "energy",           # 匹配所有 power_consumption_*
+    "default_power_on_state": "default",     # 匹配所有 default_power_on_state_*
+}
+
+
+def _freeze(mapping):
+    """驻留键和值并返回只读视图：查找时字符串比较可直接按指针命中"""
+    return MappingProxyType({sys.intern(k): sys.intern(v) for k, v in mapping.items()})
+
+
+PROPERTY_MAPPING = _freeze(_PROPERTY_MAPPING_RAW)
+KEYWORD_MAPPING = _freeze(_KEYWORD_MAPPING_RAW)
@@ -0,0 +1,38 @@
+"""HA REST API的HTTP会话构建（实体发现与网关同步共用）"""
+from typing import Dict, Optional
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_insecure_warning_disabled = False  # InsecureRequestWarning是否已屏蔽（进程内只需执行一次）
+
+
+def make_ha_session(ha_url: Optional[str] = None, headers: Optional[Dict] = None,
+                    pool_connections: int = 1, pool_maxsize: int = 8,
+                    retries: int = 0) -> requests.Session:
+    """
+    创建访问HA的复用会话（连接池+keep-alive）
+    :param ha_url: HA地址，仅用于判断是否为HTTPS
+    :param headers: 认证头，设置到会话上
+    :param pool_connections: 连接池缓存的主机数
+    :param pool_maxsize: 单个主机的连接池大小（不小于并发线程数）
+    :param retries: 连接失败时的重试次数（读取失败只对GET等幂等请求重试）
+    :return: 配置好的requests会话
+    """
+    global _insecure_warning_disabled
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    # HA为Add-on内部地址：不读取代理/netrc环境变量；HTTPS常见自签名证书，关闭校验并屏蔽对应告警
+    session.trust_env = False
+    if (ha_url or "").startswith("https"):
+        session.verify = False
+        if not _insecure_warning_disabled:
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            _insecure_warning_disabled = True
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=Retry(total=retries))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
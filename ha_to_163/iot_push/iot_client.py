@@ -3,10 +3,23 @@ import json
 import logging
 import time
 import hmac
-import hashlib
-from typing import Dict, Any, Optional
+import functools
+import itertools
+import random
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, Optional
 import paho.mqtt.client as mqtt
 import requests
+from ha_session import make_ha_session
+
+try:
+    import orjson  # C实现的JSON解析器（可选依赖）
+except ImportError:
+    orjson = None
 
 # 网易IoT响应码配置
 RESPONSE_CODE = {
@@ -16,16 +29,185 @@ RESPONSE_CODE = {
     "param_error": 400
 }
 
-# 值映射配置
-VALUE_MEANING = {
-    "on": 1,
-    "off": 0,
-    True: 1,
-    False: 0,
-    "True": 1,
-    "False": 0
+# 等待同步到HA的控制指令上限，超出后直接回复失败（HA响应过慢时防止指令无限堆积）
+MAX_PENDING_COMMANDS = 256
+
+# paho发布错误码说明
+PUBLISH_ERROR_MEANINGS = {
+    1: "内存不足", 2: "协议错误", 3: "输入参数无效",
+    4: "客户端未连接", 5: "连接被拒绝", 6: "消息未找到",
+    7: "连接丢失", 8: "TLS错误", 9: "负载过大",
+    10: "不支持", 11: "认证错误", 12: "ACL拒绝",
+    13: "未知错误", 14: "系统错误", 15: "队列大小错误"
+}
+
+# 消息发布结果（_publish_*方法的返回值）
+PUBLISH_FAILED = 0  # 发布失败
+PUBLISH_SENT = 1  # 已交给paho发送
+PUBLISH_QUEUED = 2  # 连接不可用，已暂存到待发送队列，重连后补发
+PUBLISH_SKIPPED = 3  # 属性相对上次上报均无变化，未发布
+
+# 单个SUBSCRIBE报文最多携带的主题数（部分IoT平台限制每次订阅的主题数量）
+SUBSCRIBE_BATCH_SIZE = 8
+
+# 断线期间最多暂存的待发送消息数，超出后丢弃最早的消息
+MAX_OUTBOX_MESSAGES = 512
+# 暂存超过这段时间（秒）的控制指令回复不再补发（平台早已按超时处理该指令）
+OUTBOX_REPLY_TTL_SECONDS = 30
+
+# 最多跟踪的未确认（等待PUBACK）消息数，超出后丢弃最早的记录（仅DEBUG日志级别下跟踪）
+MAX_INFLIGHT_TRACKED = 1024
+# paho同时在途的QoS1消息数，以及其后允许排队的消息数（队列满时publish立即返回错误，不阻塞调用方）
+MAX_INFLIGHT_MESSAGES = 20
+MAX_QUEUED_MESSAGES = MAX_INFLIGHT_TRACKED
+
+# 控制指令验证过的实体在这段时间内（秒）不再重复查询是否存在，过期后重新验证（实体可能已被删除或重命名）
+VERIFIED_ENTITY_TTL_SECONDS = 300
+# 最多记录的已验证实体数，超出后丢弃最早的记录
+MAX_VERIFIED_ENTITIES = 256
+
+# 重连延迟附加的随机抖动上限（秒），避免多个实例断线后同时重连
+RECONNECT_JITTER_SECONDS = 1.0
+
+# 属性上报消息模板：{"id":"<id>","params":<params>}（外层结构固定，只需序列化params）
+_POST_PREFIX = b'{"id":"'
+_POST_MIDDLE = b'","params":'
+_POST_SUFFIX = b'}'
+# 控制指令Topic：sys/{product_key}/{device_name}/service/CommonService 等（至少5段）
+_TOPIC_RE = re.compile(r"^sys/([^/]*)/([^/]*)/[^/]*/")
+
+# 控制指令回复模板：{"id":<id>,"code":<code>,"data":<data>}（data为空时直接使用常量）
+_REPLY_PREFIX = b'{"id":'
+_REPLY_CODE = b',"code":%d,"data":'
+_REPLY_EMPTY_DATA = b'{}'
+
+# 可控参数 → (实体域, 实体特征后缀)（基于发现时的规律）
+PARAM_ENTITY_SUFFIX = {
+    "state0": ("switch", "on_p_2_1"),
+    "state1": ("switch", "on_p_7_1"),
+    "state2": ("switch", "on_p_8_1"),
+    "state3": ("switch", "on_p_9_1"),
+    "state4": ("switch", "on_p_10_1"),
+    "state5": ("switch", "on_p_11_1"),
+    "state6": ("switch", "on_p_12_1"),
+    "default": ("select", "default_power_on_state_p_2_2"),
+}
+
+# 开关类参数（state0为总开关，state1~6为各插口）
+SWITCH_PARAMS = frozenset(("state0", "state1", "state2", "state3", "state4", "state5", "state6"))
+
+# 开关指令：IoT值 → (HA状态, HA服务)，未列出的值一律视为关闭
+SWITCH_ON_ACTION = ("on", "switch.turn_on")
+SWITCH_OFF_ACTION = ("off", "switch.turn_off")
+SWITCH_ACTIONS = {1: SWITCH_ON_ACTION}
+
+# 上电状态选项：HA中文选项 → 网易云数值，及其反向映射
+DEFAULT_OPTION_VALUE = {"上电关闭": 0, "上电打开": 1, "断电记忆": 2}
+DEFAULT_VALUE_OPTION = {value: option for option, value in DEFAULT_OPTION_VALUE.items()}
+
+
+_MISSING = object()  # 缓存中不存在的属性，与任何值都不相等
+
+
+# 视为"开"的开关值
+_SWITCH_TRUTHY = frozenset((1, "1", "on", True, "True"))
+
+
+def _to_switch_value(value) -> int:
+    """开关类型：确保为整数 0 或 1"""
+    try:
+        return 1 if value in _SWITCH_TRUTHY else 0
+    except TypeError:  # 不可哈希的值（如列表）一律视为关闭
+        return 0
+
+
+def _to_default_value(value) -> int:
+    """默认状态选择器：反向映射（HA中文选项 → 网易云数值），数字直接使用"""
+    if isinstance(value, str):
+        return DEFAULT_OPTION_VALUE.get(value, 0)
+    return int(value) if isinstance(value, (int, float)) else 0
+
+
+# 上报值转换：IoT参数名 → 转换函数（未列出的属性直接保留原值）
+VALUE_CONVERTERS = {
+    **dict.fromkeys(SWITCH_PARAMS, _to_switch_value),
+    "default": _to_default_value,
+    # 传感器数值：确保为浮点数
+    **dict.fromkeys(("active_power", "current", "voltage", "energy"), float),
+}
+
+# 子设备推送时即使值未变化也要推送的属性（平台按上报次数累计/判断在线的字段），
+# 可通过always_push_keys配置项覆盖
+ALWAYS_PUSH_KEYS = frozenset({"energy"})
+
+# 强制同步时读取的实体：(实体域, 实体特征后缀, 状态键)
+SYNC_ENTITY_SUFFIX = (
+    ("switch", "on_p_2_1", "all_switch"),
+    ("switch", "on_p_7_1", "jack_1"),
+    ("switch", "on_p_8_1", "jack_2"),
+    ("switch", "on_p_9_1", "jack_3"),
+    ("switch", "on_p_10_1", "jack_4"),
+    ("switch", "on_p_11_1", "jack_5"),
+    ("switch", "on_p_12_1", "jack_6"),
+    ("select", "default_power_on_state_p_2_2", "default_power_on_state"),
+    ("sensor", "electric_power_p_2_6", "electric_power"),
+    ("sensor", "electric_current_p_2_7", "electric_current"),
+    ("sensor", "voltage_p_2_8", "voltage"),
+    ("sensor", "power_consumption_p_2_9", "power_consumption"),
+)
+SYNC_SWITCH_KEYS = frozenset(("all_switch", "jack_1", "jack_2", "jack_3", "jack_4", "jack_5", "jack_6"))
+
+
+def _sync_switch_value(state) -> int:
+    """开关实体状态：on → 1，其他 → 0"""
+    return 1 if state == "on" else 0
+
+
+def _sync_default_value(state) -> int:
+    """智能插座上电状态：中文选项映射"""
+    return DEFAULT_OPTION_VALUE.get(state, 0)
+
+
+# 强制同步的状态转换：状态键 → 转换函数（未列出的为数值类型传感器）
+SYNC_VALUE_CONVERTERS = {
+    **dict.fromkeys(SYNC_SWITCH_KEYS, _sync_switch_value),
+    "default_power_on_state": _sync_default_value,
 }
 
+# 动态查询到的HA实体列表复用时间（秒）：同一条指令内多个参数缓存未命中时只查询一次/states
+HA_STATES_CACHE_SECONDS = 2.0
+
+# 强制同步时并发获取实体状态的线程数：所有实体一轮并发读完
+FETCH_STATE_WORKERS = len(SYNC_ENTITY_SUFFIX)
+# 所有客户端共用的HA请求线程池：强制同步时并发读取实体状态、控制指令并发调用多组服务
+# （线程按需创建，空闲时复用，不再每次都新建线程）
+_ha_io_pool = ThreadPoolExecutor(max_workers=FETCH_STATE_WORKERS, thread_name_prefix="ha-io")
+
+
+def _loads(data):
+    """解析JSON（优先使用orjson，直接接受bytes，不可用时回退到标准库）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+if orjson is not None:
+    # 发布热路径直接调用C实现，省去每条消息一层Python函数调用
+    _dumps = orjson.dumps
+else:
+    def _dumps(obj) -> bytes:
+        """序列化为紧凑的UTF-8 JSON字节串（与orjson输出一致）"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=8)
+def _mqtt_password(secret_bytes: bytes, counter: int) -> str:
+    """由设备密钥和5分钟计数器计算MQTT密码（进程内缓存，客户端重建后仍可复用）"""
+    # 修复：使用正确的方式 - 获取二进制摘要前10字节，然后转hex大写
+    token = hmac.digest(secret_bytes, b"%d" % counter, "sha256")[:10].hex().upper()
+    return f"v1:{token}"
+
+
 class NeteaseIoTClient:
     """网易IoT MQTT客户端（正确的认证方式）"""
     def __init__(self, device_config: Dict, mqtt_config: Dict):
@@ -35,6 +217,7 @@ class NeteaseIoTClient:
         self.device_name = device_config["device_name"]
         self.device_secret = device_config["device_secret"]
         self.entity_prefix = device_config["entity_prefix"]
+        self._secret_bytes = self.device_secret.encode('utf-8')
         
         # MQTT配置
         self.mqtt_host = mqtt_config.get("host")
@@ -44,23 +227,43 @@ class NeteaseIoTClient:
         
         # 状态管理
         self.connected = False
-        self.last_heartbeat = 0
-        self.last_time_sync = 0
+        self._connack_event = threading.Event()  # 收到CONNACK（无论成功与否）时置位，connect()据此等待
+        self.last_heartbeat = 0  # 单调时钟（time.monotonic），不受NTP校时影响
+        self.last_time_sync = None  # 上次NTP同步的单调时钟时间，None表示尚未同步
+        self._time_sync_lock = threading.Lock()  # NTP同步进行中时持有
         self.reconnect_count = 0
         self.max_reconnect = 10
         self.enabled = device_config.get("enabled", True)
         self.reconnect_delay = 1
+        self._reconnect_event = threading.Event()  # 重连请求信号
+        self._reconnect_thread = None  # 常驻重连线程（首次需要重连时启动）
+        self._closed = threading.Event()  # close()时置位：不再重连，并立即唤醒重连等待
+        
+        # 发现模块引用（由网关管理器设置，用于获取实体映射）
+        self.discovery = None
+        
+        # 子设备配置（由网关管理器设置），赋值时同时建立 (product_key, device_name) → (配置, 回复Topic) 索引
+        self._subdevice_configs = None
+        self._subdevice_by_key = {}
+        # 子设备属性上报Topic缓存：(product_key, device_name) → Topic，避免每条消息重新格式化
+        self._subdevice_post_topics = {}
         
         # 自动重启机制
         self.failed_reconnect_count = 0  # 累计失败重连次数
+        self._reconnect_attempts = 0  # 本次断线以来的重连次数（连接成功后清零，用于日志限流）
         self.max_failed_reconnects = 10  # 最大失败重连次数，超过则重启程序
         self.restart_callback = None  # 程序重启回调函数
         
         # 状态缓存和同步管理
         self.cached_states = {}  # 缓存最后的实体状态
         self.pending_states = {}  # 待推送的状态变化
+        self._state_lock = threading.Lock()  # 保护cached_states/pending_states的合并与快照
         self.last_sync_time = 0  # 上次同步时间
         self.sync_on_reconnect = True  # 重连时是否同步状态
+        # 子设备推送时不参与变化比对、每次都推送的属性
+        self.always_push_keys = frozenset(mqtt_config.get("always_push_keys", ALWAYS_PUSH_KEYS))
+        # 各子设备上次上报的属性 {(product_key, device_name): {参数: 值}}，用于只推送变化的属性
+        self._subdevice_last_pushed = {}
         self.subscribed_topics = set()  # 已订阅的主题集合
         
         # Topic配置（动态生成）
@@ -68,67 +271,133 @@ class NeteaseIoTClient:
         self.topic_control_reply = f"sys/{self.product_key}/{self.device_name}/service/CommonService_reply"
         self.topic_property_post = f"sys/{self.product_key}/{self.device_name}/event/property/post"
         
+        # 已发布未确认的消息 {mid: (topic, 发布时的单调时钟时间)}，仅DEBUG级别下记录，用于_on_publish输出确认耗时
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # 断线期间暂存的待发送消息 (topic, payload)，重连成功后按顺序补发
+        self._outbox = deque(maxlen=MAX_OUTBOX_MESSAGES)
+        
+        # 消息ID：从当前毫秒时间戳开始递增，进程内唯一
+        self._next_id = itertools.count(time.time_ns() // 1_000_000)
+        
         # 日志
         self.logger = logging.getLogger(f"iot_client_{self.device_id}")
         
         # HA配置
         self.ha_config = {}
+        self._ha_api_base = ""  # HA REST API根地址（以/api结尾，set_ha_config时计算）
+        self._ha_states_prefix = ""  # 实体状态URL前缀（以/states/结尾）
+        
+        # 复用同一个HTTP会话同步HA（set_ha_config时按HA地址和认证头重建）
+        self._http = self._make_http_session()
+        # 控制指令的HA同步放到独立线程执行，避免阻塞MQTT网络循环线程；
+        # 单个工作线程保证同一网关下的指令按到达顺序执行
+        self._ha_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ha-sync-{self.device_id}")
+        self._pending_commands = threading.BoundedSemaphore(MAX_PENDING_COMMANDS)
+        self._verified_entities = {}  # 已确认在HA中存在的实体 {entity_id: 验证时的单调时钟时间}
+        self._ha_entity_ids = None  # 最近一次查询到的HA全部实体ID
+        self._ha_entity_id_set = frozenset()
+        self._ha_entity_ids_time = 0.0
+        
+        # 按entity_prefix预先生成的实体映射表（entity_prefix变化时由update_config重建）
+        self._sync_entity_map = {}
+        self._param_entity_map = {}
+        self._rebuild_maps()
         
         # MQTT客户端（将在连接时初始化）
         self.client = None
         
+    @property
+    def subdevice_configs(self):
+        """网关下的子设备配置列表"""
+        return self._subdevice_configs
+
+    @subdevice_configs.setter
+    def subdevice_configs(self, configs):
+        self._subdevice_configs = configs
+        self._subdevice_by_key = {
+            (cfg.get("product_key"), cfg.get("device_name")): (
+                cfg, f"sys/{cfg.get('product_key')}/{cfg.get('device_name')}/service/CommonService_reply"
+            )
+            for cfg in configs or ()
+        }
+
     def _generate_mqtt_password(self) -> str:
         """生成MQTT连接密码（基于HMAC-SHA256的动态令牌）"""
         try:
-            # 每5分钟同步一次时间
-            if time.time() - self.last_time_sync > 300:
-                self._sync_time()
-            
-            timestamp = int(time.time())
-            counter = timestamp // 300  # 每5分钟更新一次计数器
-            self.logger.info(f"密码生成参数 - 时间戳: {timestamp}, counter: {counter}, device_secret: {self.device_secret}")
-            
-            counter_bytes = str(counter).encode('utf-8')
-            secret_bytes = self.device_secret.encode('utf-8')
-            hmac_obj = hmac.new(secret_bytes, counter_bytes, hashlib.sha256)
-            # 修复：使用正确的方式 - 获取二进制摘要前10字节，然后转hex大写
-            token = hmac_obj.digest()[:10].hex().upper()
-            password = f"v1:{token}"
-            self.logger.info(f"生成的MQTT密码: {password}")
+            # 每5分钟同步一次时间（后台线程执行，不阻塞连接；NTP只做校验，密码直接使用本地时间）
+            # 断线重连期间跳过：网络多半同样不可用，且5分钟窗口内的计数器不受影响
+            if self._reconnect_attempts == 0 and (
+                    self.last_time_sync is None or time.monotonic() - self.last_time_sync > 300):
+                self._start_time_sync()
+            
+            counter = int(time.time()) // 300  # 每5分钟更新一次计数器
+            
+            # 同一5分钟窗口内密码不变，直接复用缓存
+            password = _mqtt_password(self._secret_bytes, counter)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                # 只记录计数器和缓存命中情况，不输出设备密钥
+                self.logger.debug("MQTT密码 counter: %s, 缓存: %s", counter, _mqtt_password.cache_info())
             return password
         except Exception as e:
             self.logger.error(f"生成MQTT密码失败: {e}")
             raise
     
+    def _start_time_sync(self):
+        """在后台线程执行NTP同步（同一时间最多一个同步线程）"""
+        if self._time_sync_lock.acquire(blocking=False):
+            threading.Thread(target=self._sync_time, name=f"ntp-sync-{self.device_id}", daemon=True).start()
+
     def _sync_time(self):
         """通过NTP服务器同步时间（确保密码生成的时间准确性）"""
         try:
             from ntp_sync import sync_time_with_netease_ntp
             if sync_time_with_netease_ntp():
-                self.last_time_sync = time.time()
+                self.last_time_sync = time.monotonic()
                 self.logger.info("NTP时间同步成功")
             else:
                 self.logger.warning("NTP时间同步失败，使用本地时间")
         except Exception as e:
             self.logger.warning(f"时间同步异常: {e}")
+        finally:
+            self._time_sync_lock.release()
     
     def set_ha_config(self, ha_config: Dict):
         """设置HA配置"""
         self.ha_config = ha_config
+        # 处理HA Add-on环境中的URL构建（地址可能已包含/api）
+        ha_url = (ha_config.get("ha_url") or "").rstrip("/")
+        self._ha_api_base = ha_url if ha_url.endswith("/api") else f"{ha_url}/api"
+        self._ha_states_prefix = f"{self._ha_api_base}/states/"
+        # 按HA地址和认证头重建会话，之后的请求不再逐个传入认证头
+        old_http, self._http = self._http, self._make_http_session(ha_url, ha_config.get("ha_headers"))
+        old_http.close()
+
+    @staticmethod
+    def _make_http_session(ha_url: Optional[str] = None, headers: Optional[Dict] = None) -> requests.Session:
+        """创建同步HA的会话：空闲连接被HA关闭时重试一次，连接池不小于并发读取线程数"""
+        return make_ha_session(ha_url, headers, pool_connections=4,
+                               pool_maxsize=max(16, FETCH_STATE_WORKERS), retries=1)
 
     def _on_connect(self, client, userdata, flags, rc):
         """连接成功回调函数"""
         if rc == 0:
             self.connected = True
-            self.last_heartbeat = time.time()
+            self._connack_event.set()
+            self.last_heartbeat = time.monotonic()
             self.reconnect_count = 0
             self.reconnect_delay = 1  # 重置重连延迟
-            self.logger.info(f"MQTT连接成功: {self.device_id} (ClientID: {self.device_name})")
+            self._reconnect_attempts = 0
+            self.logger.info("MQTT连接成功: %s (ClientID: %s)", self.device_id, self.device_name)
             
+            # 收集需要订阅的主题（去重并保持顺序），合并为少量SUBSCRIBE报文发送
             # 订阅网关自己的控制主题
-            client.subscribe(self.topic_control, qos=1)
-            self.subscribed_topics.add(self.topic_control)
-            self.logger.info(f"订阅网关控制Topic: {self.topic_control}")
+            # 平台侧的属性状态可能已丢失，子设备下一次推送改为全量
+            with self._state_lock:
+                self._subdevice_last_pushed = {}
+            
+            topics = {self.topic_control: None}
+            self.logger.info("订阅网关控制Topic: %s", self.topic_control)
             
             # ✅ 关键修复：如果是网关设备，订阅所有子设备的控制主题
             if hasattr(self, 'subdevice_configs') and self.subdevice_configs:
@@ -138,23 +407,32 @@ class NeteaseIoTClient:
                     if subdevice_pk and subdevice_dn:
                         # 订阅子设备控制主题
                         subdevice_control_topic = f"sys/{subdevice_pk}/{subdevice_dn}/service/CommonService"
-                        client.subscribe(subdevice_control_topic, qos=1)
-                        self.subscribed_topics.add(subdevice_control_topic)
-                        self.logger.info(f"✅ 订阅子设备控制Topic: {subdevice_control_topic}")
+                        topics[subdevice_control_topic] = None
+                        self.logger.info("✅ 订阅子设备控制Topic: %s", subdevice_control_topic)
                         
                         # 订阅子设备属性设置主题（备用）
                         subdevice_property_set_topic = f"sys/{subdevice_pk}/{subdevice_dn}/thing/service/property/set"
-                        client.subscribe(subdevice_property_set_topic, qos=1)
-                        self.subscribed_topics.add(subdevice_property_set_topic)
-                        self.logger.info(f"✅ 订阅子设备属性设置Topic: {subdevice_property_set_topic}")
+                        topics[subdevice_property_set_topic] = None
+                        self.logger.info("✅ 订阅子设备属性设置Topic: %s", subdevice_property_set_topic)
             else:
                 self.logger.warning("❌ 网关未配置子设备信息，无法订阅子设备控制主题")
             
+            topic_list = list(topics)
+            for i in range(0, len(topic_list), SUBSCRIBE_BATCH_SIZE):
+                client.subscribe([(topic, 1) for topic in topic_list[i:i + SUBSCRIBE_BATCH_SIZE]])
+            self.subscribed_topics.update(topic_list)
+            
             # 重连后同步状态（首次连接跳过）
-            if self.sync_on_reconnect and (self.reconnect_count > 0 or self.cached_states or self.pending_states):
+            resync = self.sync_on_reconnect and bool(self.reconnect_count > 0 or self.cached_states or self.pending_states)
+            
+            # 补发断线期间暂存的消息（先于全量状态同步，保证最新状态最后到达）
+            self._flush_outbox(resync)
+            
+            if resync:
                 self._sync_all_states_on_reconnect()
         else:
             self.connected = False
+            self._connack_event.set()  # 连接被拒绝，立即结束connect()的等待
             self.reconnect_count += 1
             # 详细的错误码说明
             error_messages = {
@@ -178,56 +456,46 @@ class NeteaseIoTClient:
 
     def _on_message(self, client, userdata, msg):
         """消息回调 - 处理云端下发的控制指令"""
+        topic_match = None
         try:
             topic = msg.topic
-            payload = json.loads(msg.payload.decode("utf-8"))
-            self.logger.info(f"收到控制指令: {topic} -> {payload}")
+            payload = _loads(msg.payload)
+            # 直接记录原始报文，不再把解析后的dict重新格式化一遍
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("收到控制指令: %s -> %s", topic, msg.payload.decode('utf-8', 'replace'))
             
+            # 只用到顶层的id和params；成功回复直接复用params对象，不做拷贝
             cmd_id = payload.get("id")
             params = payload.get("params", {})
             
             # 提取子设备信息（从Topic中解析）
             # Topic格式: sys/{product_key}/{device_name}/service/CommonService
-            topic_parts = topic.split("/")
-            if len(topic_parts) >= 5 and topic_parts[0] == "sys":
-                subdevice_product_key = topic_parts[1]
-                subdevice_device_name = topic_parts[2]
+            topic_match = _TOPIC_RE.match(topic)
+            if topic_match:
+                subdevice_product_key, subdevice_device_name = topic_match.groups()
                 
-                # 查找对应的子设备配置
-                target_device_config = None
-                if hasattr(self, 'subdevice_configs') and self.subdevice_configs:
-                    for device_config in self.subdevice_configs:
-                        if (device_config.get("product_key") == subdevice_product_key and 
-                            device_config.get("device_name") == subdevice_device_name):
-                            target_device_config = device_config
-                            break
+                # 查找对应的子设备配置（索引在设置subdevice_configs时建立）
+                target = self._subdevice_by_key.get((subdevice_product_key, subdevice_device_name))
                 
-                if target_device_config:
-                    device_id = target_device_config.get("device_id", "未知设备")
-                    entity_prefix = target_device_config.get("entity_prefix", "未知前缀")
-                    
-                    # 同步控制指令到HA
-                    success = self._sync_to_ha_with_prefix(params, entity_prefix)
-                    
-                    # 构造回复消息
-                    if success:
-                        reply = {"id": cmd_id, "code": RESPONSE_CODE["success"], "data": params}
-                        self.logger.info(f"设备{device_id}控制指令执行成功")
+                if target:
+                    target_device_config, reply_topic = target
+                    if not params:
+                        # 无参数指令（如探活）无需同步HA，直接回复成功
+                        self._publish_reply(cmd_id, RESPONSE_CODE["success"], None, reply_topic)
+                    elif self._pending_commands.acquire(blocking=False):
+                        # 同步到HA并回复（在后台线程执行，回调立即返回）
+                        self._ha_pool.submit(self._execute_control_command, target_device_config, cmd_id, params, reply_topic)
                     else:
-                        reply = {"id": cmd_id, "code": RESPONSE_CODE["failed"], "data": {}}
-                        self.logger.error(f"设备{device_id}控制指令执行失败")
-                    
-                    # 发送回复到对应的子设备回复主题
-                    reply_topic = f"sys/{subdevice_product_key}/{subdevice_device_name}/service/CommonService_reply"
-                    success_reply = self._publish(reply, reply_topic)
+                        # 积压指令过多，丢弃并回复失败（不阻塞网络循环线程）
+                        self.logger.warning(f"待同步控制指令已达上限({MAX_PENDING_COMMANDS})，丢弃指令: {cmd_id}")
+                        self._publish_reply(cmd_id, RESPONSE_CODE["failed"], None, reply_topic)
                     
                 else:
                     self.logger.warning(f"未找到设备配置: {subdevice_product_key}/{subdevice_device_name}")
                     
                     # 发送失败回复
-                    error_reply = {"id": cmd_id, "code": RESPONSE_CODE["param_error"], "data": {}}
                     reply_topic = f"sys/{subdevice_product_key}/{subdevice_device_name}/service/CommonService_reply"
-                    self._publish(error_reply, reply_topic)
+                    self._publish_reply(cmd_id, RESPONSE_CODE["param_error"], None, reply_topic)
             else:
                 self.logger.warning(f"无法解析控制指令Topic: {topic}")
                 
@@ -235,23 +503,44 @@ class NeteaseIoTClient:
             self.logger.error(f"处理控制指令失败: {str(e)}")
             try:
                 # 尽力发送错误回复
+                msg_id = payload.get("id")
                 error_reply = {
-                    "id": payload.get("id", str(int(time.time()*1000))),
+                    "id": msg_id if msg_id is not None else str(next(self._next_id)),
                     "code": RESPONSE_CODE["failed"], 
                     "data": {}
                 }
-                # 如果能解析到子设备信息，就发送到对应主题
-                if topic and "sys/" in topic:
-                    parts = topic.split("/")
-                    if len(parts) >= 3:
-                        error_topic = f"sys/{parts[1]}/{parts[2]}/service/CommonService_reply"
-                        self._publish(error_reply, error_topic)
+                # 如果能解析到子设备信息，就发送到对应主题（复用上面的Topic解析结果）
+                if topic_match:
+                    error_topic = f"sys/{topic_match.group(1)}/{topic_match.group(2)}/service/CommonService_reply"
+                    self._publish(error_reply, error_topic, is_reply=True)
             except:
                 pass
 
+    def _execute_control_command(self, device_config: Dict, cmd_id, params: Dict, reply_topic: str):
+        """执行控制指令：同步到HA并发送回复（在HA同步线程中运行）"""
+        device_id = device_config.get("device_id", "未知设备")
+        entity_prefix = device_config.get("entity_prefix", "未知前缀")
+        try:
+            # 同步控制指令到HA（只读视图：成功回复直接回显同一个params对象，无需拷贝）
+            success = self._sync_to_ha_with_prefix(MappingProxyType(params), entity_prefix)
+        except Exception as e:
+            self.logger.error(f"设备{device_id}控制指令同步异常: {e}")
+            success = False
+        finally:
+            self._pending_commands.release()
+        
+        # 发送回复到对应的子设备回复主题
+        if success:
+            self.logger.info("设备%s控制指令执行成功", device_id)
+            self._publish_reply(cmd_id, RESPONSE_CODE["success"], params, reply_topic)
+        else:
+            self.logger.error(f"设备{device_id}控制指令执行失败")
+            self._publish_reply(cmd_id, RESPONSE_CODE["failed"], None, reply_topic)
+
     def _on_disconnect(self, client, userdata, rc):
         """断开连接回调函数"""
         self.connected = False
+        self._connack_event.clear()
         if rc != 0:
             self.logger.warning(f"MQTT断开连接（返回码: {rc}）")
             self._schedule_reconnect()  # 异常断开时自动重连
@@ -260,6 +549,8 @@ class NeteaseIoTClient:
     
     def _schedule_reconnect(self):
         """计划重连（非阻塞方式，增加自动重启机制）"""
+        if self._closed.is_set():
+            return
         if self.reconnect_count >= self.max_reconnect or not self.enabled:
             self.failed_reconnect_count += 1
             self.logger.error(f"达到最大重连次数或已禁用，累计失败次数: {self.failed_reconnect_count}/{self.max_failed_reconnects}")
@@ -276,14 +567,39 @@ class NeteaseIoTClient:
         if self.reconnect_delay < 60:
             self.reconnect_delay = min(self.reconnect_delay * 2, 60)  # 重连延迟翻倍，最大60秒
         
-        self.logger.info(f"将在 {self.reconnect_delay} 秒后尝试重连（第{self.reconnect_count}次）")
+        self._reconnect_attempts += 1
+        if self._reconnect_log_enabled():
+            self.logger.info("将在 %s 秒后尝试重连（第%s次）", self.reconnect_delay, self.reconnect_count)
         
-        # 使用非阻塞方式延迟重连（将在后台线程中处理）
-        import threading
-        def delayed_reconnect():
-            time.sleep(self.reconnect_delay)
+        # 唤醒常驻的重连线程（非阻塞；多次请求会合并为一次重连）
+        if self._reconnect_thread is None or not self._reconnect_thread.is_alive():
+            self._reconnect_thread = threading.Thread(
+                target=self._reconnect_worker, name=f"mqtt-reconnect-{self.device_id}", daemon=True
+            )
+            self._reconnect_thread.start()
+        self._reconnect_event.set()
+
+    def _reconnect_log_enabled(self) -> bool:
+        """重连日志限流：长时间断线时只记录第1、2、4、8……次重连的过程日志"""
+        n = self._reconnect_attempts
+        return n & (n - 1) == 0
+
+    def _reconnect_worker(self):
+        """常驻重连线程：等待重连请求，延迟reconnect_delay秒后完全重新连接"""
+        while not self._closed.is_set():
+            self._reconnect_event.wait()
+            self._reconnect_event.clear()
+            # 等待重连延迟，期间close()会立即结束等待
+            if self._closed.wait(self.reconnect_delay + random.uniform(0, RECONNECT_JITTER_SECONDS)):
+                break
+            if self.connected:
+                # 等待期间连接已恢复（或是上次重连过程中遗留的过期请求），取消本次重连，避免拆掉正常的连接
+                self.logger.info("连接已恢复，取消本次重连")
+                continue
             if self.enabled and self.reconnect_count < self.max_reconnect:
-                self.logger.info("开始重连...")
+                verbose = self._reconnect_log_enabled()
+                if verbose:
+                    self.logger.info("开始重连...（本次断线第%s次）", self._reconnect_attempts)
                 # 关键：每次重连都完全重新初始化，避免状态污染
                 try:
                     if self.client:
@@ -298,82 +614,136 @@ class NeteaseIoTClient:
                         self.logger.info("✅ MQTT重连成功，重置失败计数器")
                     else:
                         self.failed_reconnect_count += 1
-                        self.logger.warning(f"MQTT重连失败，累计失败次数: {self.failed_reconnect_count}")
+                        if verbose:
+                            self.logger.warning(f"MQTT重连失败，累计失败次数: {self.failed_reconnect_count}")
                         
                 except Exception as e:
                     self.failed_reconnect_count += 1
                     self.logger.error(f"重连异常: {e}，累计失败次数: {self.failed_reconnect_count}")
-        
-        reconnect_thread = threading.Thread(target=delayed_reconnect, daemon=True)
-        reconnect_thread.start()
 
     def _on_publish(self, client, userdata, mid):
         """发布回调"""
-        self.last_heartbeat = time.time()
-        self.logger.debug(f"消息发布成功，Mid: {mid}")
+        self.last_heartbeat = time.monotonic()
+        sent = None
+        if self._inflight:
+            with self._inflight_lock:
+                sent = self._inflight.pop(mid, None)
+        if sent:
+            self.logger.debug("消息发布成功，Mid: %s，Topic: %s，耗时: %.3fs", mid, sent[0], self.last_heartbeat - sent[1])
+        else:
+            self.logger.debug("消息发布成功，Mid: %s", mid)
 
     def _on_subscribe(self, client, userdata, mid, granted_qos):
         """订阅回调"""
-        self.logger.debug(f"订阅成功，Mid: {mid}，QoS: {granted_qos}")
+        self.logger.debug("订阅成功，Mid: %s，QoS: %s", mid, granted_qos)
 
     def _on_log(self, client, userdata, level, buf):
         """MQTT日志回调（用于调试）"""
         if level == mqtt.MQTT_LOG_ERR:
-            self.logger.error(f"MQTT错误: {buf}")
+            self.logger.error("MQTT错误: %s", buf)
         elif level == mqtt.MQTT_LOG_WARNING:
-            self.logger.warning(f"MQTT警告: {buf}")
+            self.logger.warning("MQTT警告: %s", buf)
         elif level == mqtt.MQTT_LOG_INFO:
-            self.logger.info(f"MQTT信息: {buf}")
+            self.logger.info("MQTT信息: %s", buf)
         else:
-            self.logger.debug(f"MQTT调试: {buf}")
+            self.logger.debug("MQTT调试: %s", buf)
 
-    def _publish(self, data: Dict, topic: str) -> bool:
-        """安全发布消息"""
-        if not self.connected or not self.enabled:
-            self.logger.warning(f"MQTT连接不可用或设备已禁用，跳过发布")
-            return False
+    def _publish(self, data: Dict, topic: str, is_reply: bool = False) -> int:
+        """安全发布消息，返回PUBLISH_*发布结果"""
+        try:
+            payload = _dumps(data)
+        except Exception as e:
+            self.logger.error(f"发布异常: {str(e)}")
+            return PUBLISH_FAILED
+        return self._publish_payload(payload, topic, is_reply)
+
+    def _publish_property(self, params: Dict, topic: str) -> int:
+        """发布属性上报消息（按模板拼接，只序列化params），返回PUBLISH_*发布结果"""
+        try:
+            msg_id = b"%d" % next(self._next_id)
+            payload = b"".join((_POST_PREFIX, msg_id, _POST_MIDDLE, _dumps(params), _POST_SUFFIX))
+        except Exception as e:
+            self.logger.error(f"发布异常: {str(e)}")
+            return PUBLISH_FAILED
+        return self._publish_payload(payload, topic)
+
+    def _publish_reply(self, cmd_id, code: int, data: Optional[Dict], topic: str) -> int:
+        """发布控制指令回复（按模板拼接，data为空时回复{}），返回PUBLISH_*发布结果"""
+        try:
+            payload = b"".join((
+                _REPLY_PREFIX, _dumps(cmd_id), _REPLY_CODE % code,
+                _dumps(data) if data else _REPLY_EMPTY_DATA, _POST_SUFFIX,
+            ))
+        except Exception as e:
+            self.logger.error(f"发布异常: {str(e)}")
+            return PUBLISH_FAILED
+        return self._publish_payload(payload, topic, is_reply=True)
+
+    def _publish_payload(self, payload: bytes, topic: str, is_reply: bool = False) -> int:
+        """发布已序列化的消息（断线时暂存到待发送队列，重连后补发），返回PUBLISH_*发布结果"""
+        if not self.enabled:
+            self.logger.warning(f"设备已禁用，跳过发布")
+            return PUBLISH_FAILED
+        if not self.connected:
+            self._outbox.append((topic, payload, is_reply, time.monotonic()))
+            self.logger.warning("MQTT连接不可用，消息已加入待发送队列（%s条）", len(self._outbox))
+            return PUBLISH_QUEUED
         
         try:
-            payload = json.dumps(data, ensure_ascii=False)
-            self.logger.info(f"发送数据到{topic}: {payload}")
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("发送数据到%s: %s", topic, payload.decode('utf-8'))
             
             # 检查MQTT客户端状态
             if not self.client:
                 self.logger.error("MQTT客户端未初始化")
-                return False
+                return PUBLISH_FAILED
             
-            # 发布消息
+            # 发布消息（QoS1由paho负责重传，不阻塞等待PUBACK，确认在_on_publish中记录）
             result = self.client.publish(topic, payload, qos=1)
             
-            # 等待发布确认
-            try:
-                result.wait_for_publish(timeout=10)
-            except Exception as wait_e:
-                self.logger.error(f"发布超时: {wait_e}")
-                return False
-            
             if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                # 详细的错误码说明
-                error_meanings = {
-                    1: "内存不足", 2: "协议错误", 3: "输入参数无效",
-                    4: "客户端未连接", 5: "连接被拒绝", 6: "消息未找到",
-                    7: "连接丢失", 8: "TLS错误", 9: "负载过大",
-                    10: "不支持", 11: "认证错误", 12: "ACL拒绝",
-                    13: "未知错误", 14: "系统错误", 15: "队列大小错误"
-                }
-                error_msg = error_meanings.get(result.rc, f"未知错误码: {result.rc}")
+                error_msg = PUBLISH_ERROR_MEANINGS.get(result.rc, f"未知错误码: {result.rc}")
                 self.logger.error(f"发布失败: {error_msg}")
-                return False
+                return PUBLISH_FAILED
             else:
-                self.logger.info(f"发布成功")
-                return True
+                # 只在DEBUG级别下跟踪确认耗时，避免每次发布都加锁维护记录；
+                # PUBACK可能先于此处到达，此时记录会留到超出上限时被淘汰
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    with self._inflight_lock:
+                        self._inflight[result.mid] = (topic, time.monotonic())
+                        if len(self._inflight) > MAX_INFLIGHT_TRACKED:
+                            self._inflight.pop(next(iter(self._inflight)))
+                self.logger.info("发布成功")
+                return PUBLISH_SENT
         except Exception as e:
             self.logger.error(f"发布异常: {str(e)}")
-            return False
+            return PUBLISH_FAILED
+
+    def _flush_outbox(self, resync: bool = False):
+        """按顺序补发断线期间暂存的消息
 
-    def _sync_to_ha(self, params: Dict):
-        """同步命令到HA"""
-        return self._sync_to_ha_with_prefix(params, self.entity_prefix)
+        超过OUTBOX_REPLY_TTL_SECONDS的控制指令回复直接丢弃；resync为True时随后会全量同步网关属性，
+        暂存的网关属性上报（可能比缓存中的值更旧）也不再补发。
+        """
+        if not self._outbox:
+            return
+        now = time.monotonic()
+        sent = dropped = 0
+        while self.connected:
+            try:
+                topic, payload, is_reply, queued_at = self._outbox.popleft()
+            except IndexError:
+                break
+            if is_reply:
+                if now - queued_at > OUTBOX_REPLY_TTL_SECONDS:
+                    dropped += 1
+                    continue
+            elif resync and topic == self.topic_property_post:
+                dropped += 1
+                continue
+            self._publish_payload(payload, topic, is_reply)
+            sent += 1
+        self.logger.info("补发断线期间暂存的消息: %s 条，丢弃过期或由全量同步替代的消息: %s 条", sent, dropped)
 
     def _sync_to_ha_with_prefix(self, params: Dict, entity_prefix: str) -> bool:
         """同步控制指令到HA（支持指定entity_prefix）"""
@@ -383,146 +753,148 @@ class NeteaseIoTClient:
             self.logger.error("HA配置不完整，无法同步控制指令")
             return False
         
-        success_count = 0
         total_count = len(params)
         
         try:
-            ha_api_url = ha_url if ha_url.endswith("/") else f"{ha_url}/"
-            
+            # 按(服务, 选项)分组，同组实体合并为一次服务调用
+            service_batches = {}
+            sensors = self._discovered_sensors(entity_prefix)
+            now = time.monotonic()
             for param, value in params.items():
                 try:
                     # 映射参数到实体ID（使用指定的entity_prefix）
-                    entity_id = self._map_param_to_entity_with_prefix(param, entity_prefix)
+                    entity_id = self._map_param_to_entity_with_prefix(param, entity_prefix, sensors)
                     if not entity_id:
                         self.logger.warning(f"参数{param}无法映射到HA实体")
                         continue
                     
                     # 转换IoT值到HA状态
-                    if param in ["state0", "state1", "state2", "state3", "state4", "state5", "state6"]:
+                    if param in SWITCH_PARAMS:
                         # 开关类型
-                        ha_state = "on" if value == 1 else "off"
-                        service = "switch.turn_on" if value == 1 else "switch.turn_off"
-                        service_data = {"entity_id": entity_id}
+                        ha_state, service = SWITCH_ACTIONS.get(value, SWITCH_OFF_ACTION)
+                        option = None
                     elif param == "default":
                         # 默认状态选择器 (智能插座上电状态)
-                        state_map = {0: "上电关闭", 1: "上电打开", 2: "断电记忆"}
-                        ha_state = state_map.get(value, "上电关闭")
+                        ha_state = DEFAULT_VALUE_OPTION.get(value, "上电关闭")
                         service = "select.select_option"
-                        service_data = {"entity_id": entity_id, "option": ha_state}
+                        option = ha_state
                     else:
                         # 传感器类型（只读，跳过）
-                        self.logger.debug(f"跳过只读参数{param}")
-                        continue
-                    
-                    self.logger.info(f"🎯 同步控制指令: {param}={value} → {entity_id}={ha_state}")
-                    
-                    # 先验证实体是否存在
-                    # 处理HA Add-on环境中的URL构建
-                    if ha_api_url.endswith("/api/") or ha_api_url.endswith("/api"):
-                        entity_check_url = f"{ha_api_url.rstrip('/')}/states/{entity_id}"
-                    else:
-                        entity_check_url = f"{ha_api_url}api/states/{entity_id}"
-                    
-                    entity_check_resp = requests.get(
-                        entity_check_url,
-                        headers=ha_headers,
-                        timeout=5,
-                        verify=False
-                    )
-                    
-                    if entity_check_resp.status_code != 200:
-                        self.logger.error(f"❌ 实体{entity_id}不存在或不可访问，状态码: {entity_check_resp.status_code}")
+                        self.logger.debug("跳过只读参数%s", param)
                         continue
                     
-                    # 调用HA服务API（比直接设置state更可靠）
-                    domain, service_name = service.split('.', 1)
+                    self.logger.info("🎯 同步控制指令: %s=%s → %s=%s", param, value, entity_id, ha_state)
                     
-                    # 处理HA Add-on环境中的服务URL构建
-                    if ha_api_url.endswith("/api/") or ha_api_url.endswith("/api"):
-                        service_url = f"{ha_api_url.rstrip('/')}/services/{domain}/{service_name}"
-                    else:
-                        service_url = f"{ha_api_url}api/services/{domain}/{service_name}"
-                    
-                    self.logger.debug(f"🔧 调用HA服务: {service_url}")
-                    self.logger.debug(f"🔧 请求数据: {service_data}")
-                    
-                    service_resp = requests.post(
-                        service_url,
-                        headers=ha_headers,
-                        json=service_data,
-                        timeout=10,
-                        verify=False
-                    )
-                    
-                    if service_resp.status_code == 200:
-                        self.logger.info(f"✅ 控制指令执行成功: {entity_id} → {ha_state}")
-                        success_count += 1
-                    else:
-                        self.logger.error(f"❌ 控制指令执行失败: {entity_id}, 状态码: {service_resp.status_code}")
-                        self.logger.error(f"响应内容: {service_resp.text}")
+                    # 先验证实体是否存在（VERIFIED_ENTITY_TTL_SECONDS内验证过的实体跳过查询）
+                    verified_at = self._verified_entities.get(entity_id)
+                    if verified_at is None or now - verified_at > VERIFIED_ENTITY_TTL_SECONDS:
+                        entity_check_resp = self._http.get(
+                            f"{self._ha_states_prefix}{entity_id}",
+                            timeout=5
+                        )
                         
-                        # ⚠️ 控制失败时不应该尝试states API，因为那只是改变显示状态，不会控制实际设备
-                        # 直接记录为失败，让IoT平台知道控制未成功
-                        self.logger.warning(f"❌ 设备控制失败，不使用states API备用方案（避免状态不一致）")
+                        if entity_check_resp.status_code != 200:
+                            self._verified_entities.pop(entity_id, None)
+                            self.logger.error(f"❌ 实体{entity_id}不存在或不可访问，状态码: {entity_check_resp.status_code}")
+                            continue
+                        # 重新插入到末尾，超出上限时丢弃最早验证的记录
+                        self._verified_entities.pop(entity_id, None)
+                        self._verified_entities[entity_id] = now
+                        if len(self._verified_entities) > MAX_VERIFIED_ENTITIES:
+                            self._verified_entities.pop(next(iter(self._verified_entities)))
+                    
+                    service_batches.setdefault((service, option), []).append((entity_id, ha_state))
                         
                 except Exception as e:
                     self.logger.error(f"处理参数{param}时出错: {e}")
                     continue
             
-            self.logger.info(f"控制指令同步完成: {success_count}/{total_count} 成功")
+            # 各服务调用互不依赖，多于一组时并发下发（总耗时取决于最慢的一次调用）
+            if len(service_batches) > 1:
+                success_count = sum(_ha_io_pool.map(self._call_ha_service, service_batches.items()))
+            else:
+                success_count = sum(map(self._call_ha_service, service_batches.items()))
+            
+            self.logger.info("控制指令同步完成: %s/%s 成功", success_count, total_count)
             return success_count == total_count
             
         except Exception as e:
             self.logger.error(f"同步控制指令到HA失败: {e}")
             return False
 
-    def _map_param_to_entity(self, param: str) -> Optional[str]:
-        """映射IoT参数到HA实体ID"""
-        return self._map_param_to_entity_with_prefix(param, self.entity_prefix)
-
-    def _map_param_to_entity_with_prefix(self, param: str, entity_prefix: str) -> Optional[str]:
-        """映射IoT参数到HA实体ID（优先使用发现阶段的缓存数据）"""
+    def _call_ha_service(self, batch) -> int:
+        """调用一组HA服务（同一服务和选项的实体合并下发），返回成功的实体数"""
+        (service, option), targets = batch
+        entity_ids = [entity_id for entity_id, _ in targets]
+        try:
+            # 调用HA服务API（比直接设置state更可靠），entity_id以列表形式批量下发
+            domain, service_name = service.split('.', 1)
+            service_url = f"{self._ha_api_base}/services/{domain}/{service_name}"
+            service_data = {"entity_id": entity_ids}
+            if option is not None:
+                service_data["option"] = option
+            
+            self.logger.debug("🔧 调用HA服务: %s", service_url)
+            self.logger.debug("🔧 请求数据: %s", service_data)
+            
+            service_resp = self._http.post(
+                service_url,
+                json=service_data,
+                timeout=10
+            )
+            
+            if service_resp.status_code == 200:
+                for entity_id, ha_state in targets:
+                    self.logger.info("✅ 控制指令执行成功: %s → %s", entity_id, ha_state)
+                return len(targets)
+            
+            self.logger.error(f"❌ 控制指令执行失败: {entity_ids}, 状态码: {service_resp.status_code}")
+            self.logger.error(f"响应内容: {service_resp.text}")
+            # 实体可能已被删除或重命名，下次重新验证
+            for entity_id in entity_ids:
+                self._verified_entities.pop(entity_id, None)
+            
+            # ⚠️ 控制失败时不应该尝试states API，因为那只是改变显示状态，不会控制实际设备
+            # 直接记录为失败，让IoT平台知道控制未成功
+            self.logger.warning(f"❌ 设备控制失败，不使用states API备用方案（避免状态不一致）")
         
-        # 1. 首先尝试从发现模块的缓存中查找
+        except Exception as e:
+            self.logger.error(f"调用HA服务{service}时出错: {e}")
+        return 0
+
+    def _discovered_sensors(self, entity_prefix: str) -> Dict:
+        """从发现模块的缓存中取出entity_prefix对应设备的属性→实体映射（未发现时返回空dict）"""
         if self.discovery:
-            discovered_devices = self.discovery.get_discovered_devices()
-            for device_id, device_info in discovered_devices.items():
+            # 只拷贝值列表（发现线程可能同时更新该dict），不再整体拷贝发现结果
+            for device_info in list(self.discovery.discovered_devices.values()):
                 # 检查是否是目标设备（通过entity_prefix匹配）
-                device_prefix = device_info.get('config', {}).get('entity_prefix', '')
-                if device_prefix == entity_prefix:
-                    # 从sensors映射中查找对应的实体
-                    sensors = device_info.get('sensors', {})
-                    if param in sensors:
-                        entity_id = sensors[param]
-                        self.logger.info(f"✅ 从发现缓存获取实体: {param} → {entity_id}")
-                        return entity_id
+                if device_info.get('config', {}).get('entity_prefix', '') == entity_prefix:
+                    return device_info.get('sensors', {})
+        return {}
+
+    def _map_param_to_entity_with_prefix(self, param: str, entity_prefix: str,
+                                         sensors: Optional[Dict] = None) -> Optional[str]:
+        """映射IoT参数到HA实体ID（优先使用发现阶段的缓存数据）
+
+        sensors为该设备的属性→实体映射，批量映射时由调用方查找一次后传入。
+        """
+        
+        # 1. 首先尝试从发现模块的缓存中查找
+        if sensors is None:
+            sensors = self._discovered_sensors(entity_prefix)
+        if param in sensors:
+            entity_id = sensors[param]
+            self.logger.info("✅ 从发现缓存获取实体: %s → %s", param, entity_id)
+            return entity_id
         
         # 2. 如果缓存中没有，则使用动态查询（兜底方案）
         self.logger.warning(f"缓存中未找到{param}，尝试动态查询...")
         
-        # 参数到实体特征后缀的映射（基于发现时的规律）
-        param_to_suffix = {
-            "state0": "on_p_2_1",
-            "state1": "on_p_7_1", 
-            "state2": "on_p_8_1",
-            "state3": "on_p_9_1", 
-            "state4": "on_p_10_1",
-            "state5": "on_p_11_1",
-            "state6": "on_p_12_1",
-            "default": "default_power_on_state_p_2_2"
-        }
-        
-        param_to_domain = {
-            "state0": "switch", "state1": "switch", "state2": "switch",
-            "state3": "switch", "state4": "switch", "state5": "switch", 
-            "state6": "switch", "default": "select"
-        }
-        
-        suffix = param_to_suffix.get(param)
-        domain = param_to_domain.get(param)
-        if not suffix or not domain:
+        target = PARAM_ENTITY_SUFFIX.get(param)
+        if not target:
             self.logger.warning(f"参数{param}不支持控制")
             return None
+        domain, suffix = target
         
         # 动态查询HA实体
         ha_url = self.ha_config.get("ha_url")
@@ -532,44 +904,61 @@ class NeteaseIoTClient:
             return None
         
         try:
-            # 查询HA中的所有实体
-            # 处理HA Add-on环境中的URL构建
-            if ha_url.endswith("/api") or ha_url.endswith("/api/"):
-                states_list_url = f"{ha_url.rstrip('/')}/states"
-            else:
-                states_list_url = f"{ha_url}/api/states"
-            
-            resp = requests.get(
-                states_list_url,
-                headers=ha_headers,
-                timeout=10,
-                verify=False
-            )
-            if resp.status_code != 200:
-                self.logger.error(f"查询HA实体失败，状态码: {resp.status_code}")
-                self.logger.error(f"响应内容: {resp.text}")
+            # 查询HA中的所有实体（短时间内复用，同一条指令的多个参数只查询一次）
+            entity_ids = self._get_ha_entity_ids()
+            if entity_ids is None:
                 return None
 
-            entities = resp.json()
+            # 标准命名的实体直接按集合查找
+            candidate = f"{domain}.{entity_prefix}_{suffix}"
+            if candidate in self._ha_entity_id_set:
+                self.logger.info("✅ 动态查询匹配: %s → %s", param, candidate)
+                return candidate
+
             # 精确匹配：同时满足domain、entity_prefix、suffix
-            for entity in entities:
-                entity_id = entity["entity_id"]
+            for entity_id in entity_ids:
                 if (entity_id.startswith(f"{domain}.") and 
                     entity_prefix in entity_id and 
                     entity_id.endswith(suffix)):
-                    self.logger.info(f"✅ 动态查询匹配: {param} → {entity_id}")
+                    self.logger.info("✅ 动态查询匹配: %s → %s", param, entity_id)
                     return entity_id
             
             # 如果精确匹配失败，使用硬编码兜底
-            fallback_entity = f"{domain}.{entity_prefix}_{suffix}"
+            fallback_entity = self._fallback_entity(param, entity_prefix, domain, suffix)
             self.logger.warning(f"⚠️ 动态查询失败，使用兜底映射: {param} → {fallback_entity}")
             return fallback_entity
 
         except Exception as e:
             self.logger.error(f"动态查询实体异常: {e}")
             # 异常情况下的硬编码兜底
-            fallback_entity = f"{param_to_domain[param]}.{entity_prefix}_{param_to_suffix[param]}"
-            return fallback_entity
+            return self._fallback_entity(param, entity_prefix, domain, suffix)
+
+    def _get_ha_entity_ids(self) -> Optional[tuple]:
+        """查询HA中的全部实体ID（HA_STATES_CACHE_SECONDS内复用上次结果），查询失败返回None"""
+        now = time.monotonic()
+        if self._ha_entity_ids is None or now - self._ha_entity_ids_time > HA_STATES_CACHE_SECONDS:
+            resp = self._http.get(
+                f"{self._ha_api_base}/states",
+                timeout=10
+            )
+            if resp.status_code != 200:
+                self.logger.error(f"查询HA实体失败，状态码: {resp.status_code}")
+                self.logger.error(f"响应内容: {resp.text}")
+                return None
+            self._remember_ha_entity_ids(tuple(entity["entity_id"] for entity in _loads(resp.content)), now)
+        return self._ha_entity_ids
+
+    def _remember_ha_entity_ids(self, entity_ids: tuple, now: float):
+        """刷新实体ID缓存"""
+        self._ha_entity_ids = entity_ids
+        self._ha_entity_id_set = frozenset(entity_ids)
+        self._ha_entity_ids_time = now
+
+    def _fallback_entity(self, param: str, entity_prefix: str, domain: str, suffix: str) -> str:
+        """硬编码兜底实体ID（本网关前缀直接取预生成的映射表）"""
+        if entity_prefix == self.entity_prefix:
+            return self._param_entity_map[param]
+        return f"{domain}.{entity_prefix}_{suffix}"
 
     def _init_mqtt_client(self):
         """初始化MQTT客户端，设置认证信息和回调函数"""
@@ -586,8 +975,20 @@ class NeteaseIoTClient:
                 except:
                     pass
             
-            self.client = mqtt.Client(client_id=client_id, clean_session=True, protocol=mqtt.MQTTv311)
+            # 新客户端的mid从1重新计数且clean_session不会补发旧消息，丢弃旧连接上未确认的记录
+            with self._inflight_lock:
+                stale = len(self._inflight)
+                self._inflight.clear()
+            if stale:
+                self.logger.warning("上一连接有 %s 条消息未收到PUBACK，已放弃跟踪", stale)
+            
+            # 关闭paho内置的自动重连：断线后由重连线程用新密码重建客户端，
+            # 避免paho网络线程同时用过期密码重连，与重建流程互相干扰
+            self.client = mqtt.Client(client_id=client_id, clean_session=True, protocol=mqtt.MQTTv311,
+                                      reconnect_on_failure=False)
             self.client.username_pw_set(username=username, password=password)
+            self.client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+            self.client.max_queued_messages_set(MAX_QUEUED_MESSAGES)
             
             if self.use_ssl:
                 self.client.tls_set()
@@ -600,8 +1001,7 @@ class NeteaseIoTClient:
             self.client.on_subscribe = self._on_subscribe
             self.client.on_log = self._on_log
             
-            self.logger.info(f"MQTT客户端初始化完成 - ClientID: {client_id}, Username: {username}")
-            self.logger.info(f"当前密码: {password}")
+            self.logger.info("MQTT客户端初始化完成 - ClientID: %s, Username: %s", client_id, username)
         except Exception as e:
             self.logger.error(f"MQTT客户端初始化失败: {e}")
             raise
@@ -609,22 +1009,20 @@ class NeteaseIoTClient:
     def connect(self) -> bool:
         """连接到MQTT服务器"""
         if not self.enabled:
-            self.logger.info(f"设备{self.device_id}已禁用，跳过连接")
+            self.logger.info("设备%s已禁用，跳过连接", self.device_id)
             return False
             
         self._init_mqtt_client()
+        self._connack_event.clear()
         try:
             # 根据SSL配置选择端口 - 参考工作代码的逻辑
             port = 8883 if self.use_ssl else self.mqtt_port
-            self.logger.info(f"连接MQTT服务器: {self.mqtt_host}:{port} (SSL: {self.use_ssl})")
+            self.logger.info("连接MQTT服务器: %s:%s (SSL: %s)", self.mqtt_host, port, self.use_ssl)
             self.client.connect(self.mqtt_host, port, keepalive=60)
             self.client.loop_start()  # 启动网络循环线程
             
-            # 等待连接成功（超时10秒）
-            start_time = time.time()
-            while not self.connected and (time.time() - start_time) < 10:
-                time.sleep(0.1)
-            
+            # 等待CONNACK（超时10秒），_on_connect收到后无论成功失败都立即唤醒
+            self._connack_event.wait(timeout=10)
             return self.connected
         except Exception as e:
             self.logger.error(f"MQTT连接失败: {e}")
@@ -632,14 +1030,18 @@ class NeteaseIoTClient:
 
     def reconnect(self):
         """重连"""
-        if self.reconnect_count >= self.max_reconnect or not self.enabled:
-            return
-        try:
-            self.client.reconnect()
-        except Exception as e:
-            self.logger.error(f"重连失败: {str(e)}")
-            time.sleep(5)
-            self.reconnect()
+        delay = 5
+        while self.reconnect_count < self.max_reconnect and self.enabled:
+            try:
+                self.client.reconnect()
+                return
+            except Exception as e:
+                self.logger.error(f"重连失败: {str(e)}，{delay}秒后重试")
+                self.reconnect_count += 1
+                # 等待退避时间，期间close()会立即结束等待
+                if self._closed.wait(delay):
+                    return
+                delay = min(delay * 2, 60)  # 指数退避，最大60秒
 
     def disconnect(self):
         """断开连接"""
@@ -647,8 +1049,23 @@ class NeteaseIoTClient:
             self.client.loop_stop()
             self.client.disconnect()
             self.connected = False
+            self._connack_event.clear()
             self.logger.info("MQTT连接已断开")
 
+    def close(self):
+        """彻底关闭客户端：断开MQTT并释放网络循环、重连、HA同步线程及HTTP连接池
+
+        客户端被替换（如网关重新初始化）时调用，保证进程内始终只有一组MQTT相关线程。
+        """
+        self._closed.set()
+        self._reconnect_event.set()  # 唤醒重连线程使其退出
+        try:
+            self.disconnect()
+        except Exception as e:
+            self.logger.warning(f"关闭MQTT连接时出错: {e}")
+        self._ha_pool.shutdown(wait=False)
+        self._http.close()
+
     def push_property(self, ha_data: Dict):
         """推送属性数据（支持断线时缓存状态）"""
         # 缓存最新的HA实体状态
@@ -656,53 +1073,41 @@ class NeteaseIoTClient:
         
         if not self.connected or not self.enabled:
             # 如果未连接，将状态加入待推送队列
-            self.pending_states.update(ha_data)
+            with self._state_lock:
+                self.pending_states |= ha_data
             self.logger.warning(f"MQTT未连接，状态已加入待推送队列: {ha_data}")
             return
         
-        payload = {
-            "id": str(int(time.time()*1000)),
-            "params": self._convert_ha_data(ha_data)
-        }
-        self._publish(payload, self.topic_property_post)
-        self.logger.info(f"属性推送成功: {payload}")
+        params = self._convert_ha_data(ha_data)
+        if self._publish_property(params, self.topic_property_post) == PUBLISH_SENT:
+            self.logger.info("属性推送成功: %s", params)
 
     def _convert_ha_data(self, ha_data: Dict) -> Dict:
         """转换HA数据为IoT格式（直接使用IoT原生参数名，避免双重转换）"""
+        # 查表方法只取一次，循环内每个字段只剩一次字典查找；无法转换的值跳过并记录
+        converter_for = VALUE_CONVERTERS.get
         converted = {}
         for iot_key, value in ha_data.items():
-            if value is not None:
-                # 值类型转换
-                if iot_key in ["state0", "state1", "state2", "state3", "state4", "state5", "state6"]:
-                    # 开关类型：确保为整数 0 或 1
-                    converted[iot_key] = 1 if value in [1, "1", "on", True, "True"] else 0
-                elif iot_key == "default":
-                    # 默认状态选择器：反向映射（HA中文选项 → 网易云数值）
-                    reverse_state_map = {"上电关闭": 0, "上电打开": 1, "断电记忆": 2}
-                    if isinstance(value, str):
-                        converted[iot_key] = reverse_state_map.get(value, 0)
-                    else:
-                        # 如果是数字，直接使用
-                        converted[iot_key] = int(value) if isinstance(value, (int, float)) else 0
-                elif iot_key in ["active_power", "current", "voltage", "energy"]:
-                    # 传感器数值：确保为浮点数
-                    try:
-                        converted[iot_key] = float(value)
-                    except (ValueError, TypeError):
-                        self.logger.warning(f"无法转换{iot_key}的值{value}为浮点数")
-                        continue
-                else:
-                    # 其他属性直接保留
-                    converted[iot_key] = value
+            if value is None:
+                continue
+            convert = converter_for(iot_key)
+            if convert is None:
+                # 其他属性直接保留
+                converted[iot_key] = value
+                continue
+            try:
+                converted[iot_key] = convert(value)
+            except (ValueError, TypeError, OverflowError):
+                self.logger.warning(f"无法转换{iot_key}的值{value}")
         
-        self.logger.debug(f"数据转换: {ha_data} -> {converted}")
+        self.logger.debug("数据转换: %s -> %s", ha_data, converted)
         return converted
 
-    def push_subdevice_property(self, device_config: Dict[str, any], ha_data: Dict):
-        """推送子设备属性数据（按照网易IoT物模型规范）"""
+    def push_subdevice_property(self, device_config: Dict[str, any], ha_data: Dict) -> int:
+        """推送子设备属性数据（按照网易IoT物模型规范），返回PUBLISH_*发布结果"""
         if not self.connected or not self.enabled or not ha_data or not device_config:
             self.logger.warning(f"无法推送子设备数据: connected={self.connected}, enabled={self.enabled}")
-            return False
+            return PUBLISH_FAILED
         
         try:
             # 获取子设备信息
@@ -712,68 +1117,76 @@ class NeteaseIoTClient:
             
             if not subdevice_product_key or not subdevice_device_name:
                 self.logger.error(f"子设备{subdevice_id}配置不完整")
-                return False
+                return PUBLISH_FAILED
             
             # 转换HA数据为IoT格式
             converted_data = self._convert_ha_data(ha_data)
             if not converted_data:
                 self.logger.warning(f"子设备{subdevice_id}无有效数据可推送")
-                return False
+                return PUBLISH_FAILED
             
-            # 构造属性上报消息（按照物模型规范）
-            payload = {
-                "id": str(int(time.time() * 1000)),
-                "params": converted_data
+            # 只推送相对上次上报有变化的属性（always_push_keys中的属性每次都推送），重连后首次推送为全量
+            key = (subdevice_product_key, subdevice_device_name)
+            with self._state_lock:
+                last_pushed = self._subdevice_last_pushed.get(key, {})
+            always = self.always_push_keys
+            converted_data = {
+                iot_key: value for iot_key, value in converted_data.items()
+                if iot_key in always or last_pushed.get(iot_key, _MISSING) != value
             }
+            if not converted_data:
+                self.logger.debug("子设备%s属性无变化，跳过推送", subdevice_id)
+                return PUBLISH_SKIPPED
             
             # 使用正确的属性上报Topic：sys/ProductKey/DeviceName/event/property/post
-            topic = f"sys/{subdevice_product_key}/{subdevice_device_name}/event/property/post"
-            success = self._publish(payload, topic)
+            # 消息按照物模型规范构造：{"id": ..., "params": ...}
+            topic = self._subdevice_post_topics.get(key) or self._subdevice_post_topics.setdefault(
+                key, f"sys/{subdevice_product_key}/{subdevice_device_name}/event/property/post"
+            )
+            status = self._publish_property(converted_data, topic)
+            if status != PUBLISH_FAILED:
+                with self._state_lock:
+                    self._subdevice_last_pushed.setdefault(key, {}).update(converted_data)
             
-            if success:
-                self.logger.info(f"✅ 子设备{subdevice_id}属性数据推送成功: {converted_data}")
-                self.logger.info(f"推送Topic: {topic}")
-                return True
+            if status == PUBLISH_SENT:
+                self.logger.debug("✅ 子设备%s属性数据推送成功（Topic: %s）: %s", subdevice_id, topic, converted_data)
+            elif status == PUBLISH_QUEUED:
+                self.logger.debug("子设备%s属性数据已暂存，重连后补发: %s", subdevice_id, converted_data)
             else:
                 self.logger.error(f"❌ 子设备{subdevice_id}属性数据推送失败")
-                return False
+            return status
                 
         except Exception as e:
             self.logger.error(f"推送子设备{device_config.get('device_id')}属性数据异常: {e}")
-            return False
+            return PUBLISH_FAILED
 
     def _cache_states(self, ha_data: Dict):
         """缓存HA实体状态"""
         try:
-            self.cached_states.update(ha_data)
+            with self._state_lock:
+                self.cached_states |= ha_data
             self.last_sync_time = time.time()
-            self.logger.debug(f"状态已缓存: {ha_data}")
+            self.logger.debug("状态已缓存: %s", ha_data)
         except Exception as e:
             self.logger.error(f"缓存状态失败: {e}")
 
     def _sync_all_states_on_reconnect(self):
         """重连后同步所有状态"""
         try:
-            # 合并缓存状态和待推送状态
-            all_states = {**self.cached_states, **self.pending_states}
+            # 待推送状态在加入队列前已写入cached_states（且缓存中的值更新），直接清空队列；
+            # 在锁内把缓存转换为推送参数，转换结果本身就是快照，无需再复制一份缓存
+            with self._state_lock:
+                self.pending_states = {}
+                entity_count = len(self.cached_states)
+                params = self._convert_ha_data(self.cached_states) if entity_count else None
             
-            if not all_states:
+            if not params:
                 self.logger.info("重连后无状态需要同步")
                 return
             
-            self.logger.info(f"重连后同步状态: {len(all_states)} 个实体")
-            
-            # 推送所有状态
-            if all_states:
-                payload = {
-                    "id": str(int(time.time()*1000)),
-                    "params": self._convert_ha_data(all_states)
-                }
-                self._publish(payload, self.topic_property_post)
-                self.logger.info(f"重连后状态同步完成: {payload}")
-                
-                # 清空待推送队列
-                self.pending_states.clear()
+            self.logger.info("重连后同步状态: %s 个实体", entity_count)
+            if self._publish_property(params, self.topic_property_post) == PUBLISH_SENT:
+                self.logger.info("重连后状态同步完成: %s", params)
             
         except Exception as e:
             self.logger.error(f"重连后状态同步失败: {e}")
@@ -788,64 +1201,88 @@ class NeteaseIoTClient:
             return {}
         
         try:
-            ha_api_url = ha_url if ha_url.endswith("/") else f"{ha_url}/"
-            current_states = {}
-            
-            # 定义需要同步的实体映射
-            entity_map = {
-                f"switch.{self.entity_prefix}_on_p_2_1": "all_switch",
-                f"switch.{self.entity_prefix}_on_p_7_1": "jack_1", 
-                f"switch.{self.entity_prefix}_on_p_8_1": "jack_2",
-                f"switch.{self.entity_prefix}_on_p_9_1": "jack_3",
-                f"switch.{self.entity_prefix}_on_p_10_1": "jack_4",
-                f"switch.{self.entity_prefix}_on_p_11_1": "jack_5",
-                f"switch.{self.entity_prefix}_on_p_12_1": "jack_6",
-                f"select.{self.entity_prefix}_default_power_on_state_p_2_2": "default_power_on_state",
-                f"sensor.{self.entity_prefix}_electric_power_p_2_6": "electric_power",
-                f"sensor.{self.entity_prefix}_electric_current_p_2_7": "electric_current",
-                f"sensor.{self.entity_prefix}_voltage_p_2_8": "voltage",
-                f"sensor.{self.entity_prefix}_power_consumption_p_2_9": "power_consumption"
-            }
-            
-            # 获取每个实体的状态
-            for entity_id, ha_key in entity_map.items():
-                try:
-                    resp = requests.get(
-                        f"{ha_api_url}states/{entity_id}",
-                        headers=ha_headers,
-                        timeout=5,
-                        verify=False
-                    )
-                    if resp.status_code == 200:
-                        state_data = resp.json()
-                        state_value = state_data.get("state")
-                        
-                        # 转换状态值
-                        if ha_key in ["all_switch", "jack_1", "jack_2", "jack_3", "jack_4", "jack_5", "jack_6"]:
-                            current_states[ha_key] = 1 if state_value == "on" else 0
-                        elif ha_key == "default_power_on_state":
-                            # 智能插座上电状态：中文选项映射
-                            state_map = {"上电关闭": 0, "上电打开": 1, "断电记忆": 2}
-                            current_states[ha_key] = state_map.get(state_value, 0)
-                        else:
-                            # 数值类型传感器
-                            try:
-                                current_states[ha_key] = float(state_value)
-                            except (ValueError, TypeError):
-                                self.logger.warning(f"实体 {entity_id} 状态值无法转换为数值: {state_value}")
-                                
-                except requests.exceptions.RequestException as e:
-                    self.logger.warning(f"获取实体 {entity_id} 状态失败: {e}")
-                except Exception as e:
-                    self.logger.error(f"处理实体 {entity_id} 状态时出错: {e}")
+            # 一次请求获取全部实体状态，本地按实体映射筛选
+            states = self._fetch_all_ha_states()
+            if states is not None:
+                current_states = {}
+                for entity_id, ha_key in self._sync_entity_map.items():
+                    if entity_id in states:
+                        value = self._convert_entity_state(entity_id, ha_key, states[entity_id])
+                        if value is not None:
+                            current_states[ha_key] = value
+            else:
+                # 批量获取失败时，回退到并发获取每个实体的状态（共用线程池和会话连接池）
+                current_states = {
+                    ha_key: value
+                    for ha_key, value in _ha_io_pool.map(self._fetch_entity_state, self._sync_entity_map.items())
+                    if value is not None
+                }
             
-            self.logger.info(f"从HA获取到 {len(current_states)} 个实体状态")
+            self.logger.info("从HA获取到 %s 个实体状态", len(current_states))
             return current_states
             
         except Exception as e:
             self.logger.error(f"获取HA当前状态失败: {e}")
             return {}
 
+    def _fetch_all_ha_states(self) -> Optional[Dict[str, str]]:
+        """通过/api/states一次获取全部实体状态 {entity_id: state}，失败返回None"""
+        try:
+            resp = self._http.get(f"{self._ha_api_base}/states", timeout=10)
+            if resp.status_code != 200:
+                self.logger.warning(f"批量获取HA实体状态失败，状态码: {resp.status_code}")
+                return None
+            states = {entity["entity_id"]: entity.get("state") for entity in _loads(resp.content)}
+            # 同一份结果顺带刷新实体ID缓存，随后的控制指令映射无需再查询一次
+            self._remember_ha_entity_ids(tuple(states), time.monotonic())
+            return states
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"批量获取HA实体状态失败: {e}")
+        except Exception as e:
+            self.logger.error(f"解析HA实体状态时出错: {e}")
+        return None
+
+    def _fetch_entity_state(self, item) -> tuple:
+        """获取单个实体的状态并转换，返回(状态键, 值)，失败时值为None"""
+        entity_id, ha_key = item
+        try:
+            resp = self._http.get(
+                f"{self._ha_states_prefix}{entity_id}",
+                timeout=5
+            )
+            if resp.status_code == 200:
+                state_data = _loads(resp.content)
+                return ha_key, self._convert_entity_state(entity_id, ha_key, state_data.get("state"))
+                        
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"获取实体 {entity_id} 状态失败: {e}")
+        except Exception as e:
+            self.logger.error(f"处理实体 {entity_id} 状态时出错: {e}")
+        return ha_key, None
+
+    def _convert_entity_state(self, entity_id: str, ha_key: str, state_value):
+        """把HA实体状态转换为同步值，无法转换时返回None"""
+        converter = SYNC_VALUE_CONVERTERS.get(ha_key)
+        if converter is not None:
+            return converter(state_value)
+        # 数值类型传感器
+        try:
+            return float(state_value)
+        except (ValueError, TypeError):
+            self.logger.warning(f"实体 {entity_id} 状态值无法转换为数值: {state_value}")
+            return None
+
+    def _rebuild_maps(self):
+        """按当前entity_prefix生成实体映射表：强制同步用的{entity_id: 状态键}和兜底用的{参数: entity_id}"""
+        self._sync_entity_map = {
+            f"{domain}.{self.entity_prefix}_{suffix}": ha_key
+            for domain, suffix, ha_key in SYNC_ENTITY_SUFFIX
+        }
+        self._param_entity_map = {
+            param: f"{domain}.{self.entity_prefix}_{suffix}"
+            for param, (domain, suffix) in PARAM_ENTITY_SUFFIX.items()
+        }
+
     def force_sync_all_states(self):
         """强制同步所有当前状态（用于手动触发）"""
         if not self.connected or not self.enabled:
@@ -862,12 +1299,10 @@ class NeteaseIoTClient:
             # 缓存并推送状态
             self._cache_states(current_states)
             
-            payload = {
-                "id": str(int(time.time()*1000)),
-                "params": self._convert_ha_data(current_states)
-            }
-            self._publish(payload, self.topic_property_post)
-            self.logger.info(f"强制同步状态完成: {len(current_states)} 个实体")
+            if self._publish_property(self._convert_ha_data(current_states), self.topic_property_post) == PUBLISH_FAILED:
+                self.logger.error("强制同步状态推送失败")
+                return False
+            self.logger.info("强制同步状态完成: %s 个实体", len(current_states))
             return True
             
         except Exception as e:
@@ -879,7 +1314,9 @@ class NeteaseIoTClient:
         self.product_key = new_config.get("product_key", self.product_key)
         self.device_name = new_config.get("device_name", self.device_name)
         self.device_secret = new_config.get("device_secret", self.device_secret)
+        self._secret_bytes = (self.device_secret or "").encode('utf-8')
         self.entity_prefix = new_config.get("entity_prefix", self.entity_prefix)
+        self._rebuild_maps()
         self.enabled = new_config.get("enabled", self.enabled)
         
         # 更新Topic
@@ -891,7 +1328,7 @@ class NeteaseIoTClient:
         if self.device_secret:
             self.client.username_pw_set(self.device_name, self.device_secret)
         
-        self.logger.info(f"设备{self.device_id}配置已更新，enabled={self.enabled}")
+        self.logger.info("设备%s配置已更新，enabled=%s", self.device_id, self.enabled)
         
         # 重新连接
         if self.enabled and not self.connected:
@@ -5,12 +5,18 @@ import threading
 import signal
 import sys
 import os
+import json
 from config_manager import ConfigManager
 from device_discovery.ha_discovery import HADiscovery
-from iot_push.iot_client import NeteaseIoTClient
+from iot_push.iot_client import NeteaseIoTClient, PUBLISH_QUEUED, PUBLISH_SENT, PUBLISH_SKIPPED
 from ntp_sync import sync_time_with_netease_ntp
 # from state_monitor import HAStateMonitor  # 移除状态监听功能
 
+try:
+    import orjson  # C实现的JSON序列化（可选依赖）
+except ImportError:
+    orjson = None
+
 # 全局日志配置
 logging.basicConfig(
     level=logging.INFO,
@@ -233,7 +239,7 @@ class GatewayManager:
                 sensors = device_info.get("sensors", {})
                 logger.info(f"  - 设备{device_id}: {len(sensors)}个传感器")
                 for prop_name, entity_id in sensors.items():
-                    logger.debug(f"    {prop_name} → {entity_id}")
+                    logger.debug("    %s → %s", prop_name, entity_id)
         else:
             logger.warning("❌ 初始设备发现未找到任何设备")
 
@@ -258,14 +264,18 @@ class GatewayManager:
                 discovered_devices = self.discovery.get_discovered_devices()
                 logger.info(f"推送循环 - 已发现设备数: {len(discovered_devices)}")
 
+                # 本周期一次性拉取全部实体状态，后续读取直接命中快照
+                if discovered_devices:
+                    self.discovery.refresh_entity_snapshot()
+
                 # 3. 获取启用的子设备配置
                 device_configs = self.config_manager.get_all_enabled_devices()
                 device_config_map = {d["device_id"]: d for d in device_configs}
 
                 # 4. 逐个子设备处理数据推送
                 if discovered_devices:
-                    logger.info(f"已发现的设备列表: {list(discovered_devices.keys())}")
-                    logger.info(f"配置中的设备列表: {list(device_config_map.keys())}")
+                    logger.info("已发现的设备列表: %s", list(discovered_devices))
+                    logger.info("配置中的设备列表: %s", list(device_config_map))
 
                 for device_id, device_info in discovered_devices.items():
                     try:
@@ -275,25 +285,25 @@ class GatewayManager:
                             logger.info(f"可用配置设备: {list(device_config_map.keys())}")
                             continue
 
-                        logger.info(f"开始处理设备: {device_id}")
+                        logger.info("开始处理设备: %s", device_id)
 
                         # 读取HA实体值（容错读取，单个实体失败不影响）
                         ha_data = {}
 
                         # === 修复数据结构不一致问题 ===
-                        logger.info(f"=== 设备{device_id}数据结构调试 ===")
-                        logger.info(f"device_info类型: {type(device_info)}")
-                        logger.info(f"device_info内容: {device_info}")
+                        logger.debug("=== 设备%s数据结构调试 ===", device_id)
+                        logger.debug("device_info类型: %s", type(device_info))
+                        logger.debug("device_info内容: %s", device_info)
 
                         # 检测并修复数据结构问题
                         if isinstance(device_info, dict):
-                            logger.info(f"device_info包含的键: {list(device_info.keys())}")
+                            logger.debug("device_info包含的键: %s", list(device_info))
 
                             # 情况1：正确的数据结构（包含sensors键）
                             if 'sensors' in device_info:
                                 sensors = device_info['sensors']
-                                logger.info(f"✅ 正确数据结构，sensors类型: {type(sensors)}")
-                                logger.info(f"sensors数量: {len(sensors) if isinstance(sensors, dict) else 'N/A'}")
+                                logger.debug("✅ 正确数据结构，sensors类型: %s", type(sensors))
+                                logger.debug("sensors数量: %s", len(sensors) if isinstance(sensors, dict) else 'N/A')
 
                             # 情况2：数据被拍平了（device_info直接就是传感器映射）
                             elif all(isinstance(v, str) and any(entity_type in v for entity_type in ['sensor.', 'switch.', 'select.', 'binary_sensor.', 'number.', 'text.'])
@@ -301,7 +311,7 @@ class GatewayManager:
                                      if isinstance(v, str) and k not in ['device_id', 'config', 'sensors']):
                                 logger.warning("⚠️ 检测到数据结构被拍平，正在修复...")
                                 sensors = device_info  # device_info本身就是传感器映射
-                                logger.info(f"修复后sensors数量: {len(sensors)}")
+                                logger.info("修复后sensors数量: %s", len(sensors))
 
                             # 情况3：其他情况
                             else:
@@ -311,28 +321,32 @@ class GatewayManager:
                             logger.error(f"device_info不是字典类型: {type(device_info)}")
                             sensors = {}
 
-                        logger.info(f"设备{device_id}可用传感器: {list(sensors.keys())}")
+                        logger.info("设备%s可用传感器: %s", device_id, list(sensors))
 
                         # 调试：显示完整的device_info结构
-                        logger.debug(f"设备{device_id}完整信息: {device_info}")
+                        logger.debug("设备%s完整信息: %s", device_id, device_info)
 
                         for prop_name, entity_id in sensors.items():
                             value = self.discovery.read_entity_value_safe(entity_id)
                             if value is not None:
                                 ha_data[prop_name] = value
-                                logger.info(f"设备{device_id} {prop_name}({entity_id}): {value}")
+                                logger.debug("设备%s %s(%s): %s", device_id, prop_name, entity_id, value)
                             else:
                                 logger.warning(f"设备{device_id} {prop_name}({entity_id}): 读取失败或值为空")
 
                         # 推送子设备数据到网易IoT平台
                         if ha_data:
-                            logger.info(f"设备{device_id}待推送数据: {ha_data}")
+                            logger.debug("设备%s待推送数据: %s", device_id, ha_data)
                             device_config = device_config_map[device_id]
-                            success = gateway_client.push_subdevice_property(
+                            status = gateway_client.push_subdevice_property(
                                 device_config, ha_data
                             )
-                            if success:
-                                logger.info(f"✅ 子设备{device_id}推送成功，字段数: {len(ha_data)}")
+                            if status == PUBLISH_SENT:
+                                logger.info("✅ 子设备%s推送成功，字段数: %s", device_id, len(ha_data))
+                            elif status == PUBLISH_QUEUED:
+                                logger.info("子设备%s数据已暂存，MQTT重连后补发", device_id)
+                            elif status == PUBLISH_SKIPPED:
+                                logger.info("子设备%s属性无变化，跳过推送", device_id)
                             else:
                                 logger.warning(f"❌ 子设备{device_id}推送失败")
                         else:
@@ -433,7 +447,7 @@ class GatewayManager:
         with self.lock:
             for device_id, client in self.iot_clients.items():
                 try:
-                    client.disconnect()
+                    client.close()
                     logger.info(f"设备{device_id}IoT连接已关闭")
                 except Exception as e:
                     logger.error(f"关闭设备{device_id}连接失败: {str(e)}")
@@ -461,9 +475,6 @@ class GatewayManager:
 
     def _check_and_discover_new_devices(self):
         """检查并发现新增设备（支持热插拔）"""
-        import hashlib
-        import json
-
         try:
             # 1. 首先检查配置文件是否有变化，避免不必要的重载
             if not self.config_manager.has_config_changed(self.last_config_check):
@@ -479,8 +490,7 @@ class GatewayManager:
 
             # 3. 计算当前设备配置的哈希值
             current_device_configs = current_config.get("devices_triple", [])
-            current_config_json = json.dumps(current_device_configs, sort_keys=True)
-            current_config_hash = hashlib.md5(current_config_json.encode()).hexdigest()
+            current_config_hash = self._get_config_hash(current_config)
 
             # 4. 检查配置是否有变化
             if self.last_config_hash and self.last_config_hash == current_config_hash:
@@ -546,13 +556,9 @@ class GatewayManager:
 
     def _initialize_dynamic_discovery(self):
         """初始化动态发现状态"""
-        import hashlib
-        import json
-
         # 获取当前设备配置并建立初始哈希值
         device_configs = self.config.get("devices_triple", [])
-        config_json = json.dumps(device_configs, sort_keys=True)
-        self.last_config_hash = hashlib.md5(config_json.encode()).hexdigest()
+        self.last_config_hash = self._get_config_hash(self.config)
 
         # 建立活跃设备配置缓存
         for device_config in device_configs:
@@ -577,7 +583,7 @@ class GatewayManager:
             old_gateway_client = self.iot_clients.get("gateway")
             if old_gateway_client:
                 try:
-                    old_gateway_client.disconnect()
+                    old_gateway_client.close()
                     logger.info("旧网关连接已断开")
                 except Exception as e:
                     logger.warning(f"关闭旧网关连接时出错: {e}")
@@ -658,7 +664,7 @@ class GatewayManager:
             with self.lock:
                 for device_id, client in self.iot_clients.items():
                     try:
-                        client.disconnect()
+                        client.close()
                         logger.info(f"重启前关闭设备{device_id}IoT连接")
                     except Exception as e:
                         logger.warning(f"重启前关闭设备{device_id}连接失败: {str(e)}")
@@ -674,6 +680,8 @@ class GatewayManager:
 
             def delayed_restart():
                 time.sleep(3)  # 给日志输出时间
+                # execv/_exit不会执行atexit，先写入尚在延迟中的配置保存
+                self.config_manager._flush()
                 try:
                     # 方式1: 使用 Python 重新执行当前脚本
                     logger.info(f"重启命令: python3 {current_file}")
@@ -700,12 +708,14 @@ class GatewayManager:
     def _get_config_hash(self, config):
         """计算配置的哈希值用于变更检测"""
         import hashlib
-        import json
         
-        # 只对设备配置部分进行哈希计算
+        # 只对设备配置部分进行哈希计算（键排序保证相同配置得到相同哈希）
         device_configs = config.get("devices_triple", [])
-        config_json = json.dumps(device_configs, sort_keys=True)
-        return hashlib.md5(config_json.encode()).hexdigest()
+        if orjson is not None:
+            config_json = orjson.dumps(device_configs, option=orjson.OPT_SORT_KEYS)
+        else:
+            config_json = json.dumps(device_configs, sort_keys=True).encode()
+        return hashlib.md5(config_json).hexdigest()
 
 # 入口函数
 if __name__ == "__main__":
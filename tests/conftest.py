@@ -0,0 +1,43 @@
+"""测试公共配置：把Add-on源码目录加入导入路径，并提供使用模拟paho客户端的网关客户端"""
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+# Add-on运行时以ha_to_163为工作目录，模块按顶层包导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ha_to_163"))
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from iot_push.iot_client import NeteaseIoTClient  # noqa: E402
+
+
+GATEWAY_CONFIG = {
+    "device_id": "gateway",
+    "product_key": "gw_pk",
+    "device_name": "gw_dn",
+    "device_secret": "secret",
+    "entity_prefix": "gateway",
+}
+
+MQTT_CONFIG = {"host": "mqtt.example", "port": 1883}
+
+
+@pytest.fixture
+def paho_client():
+    """模拟的paho客户端：publish总是成功，mid依次递增"""
+    client = mock.MagicMock()
+    mids = iter(range(1, 10000))
+    client.publish.side_effect = lambda *args, **kwargs: mock.Mock(rc=mqtt.MQTT_ERR_SUCCESS, mid=next(mids))
+    return client
+
+
+@pytest.fixture
+def iot_client(paho_client):
+    """已连接的网关客户端（不建立真实连接）"""
+    client = NeteaseIoTClient(dict(GATEWAY_CONFIG), dict(MQTT_CONFIG))
+    client.client = paho_client
+    client.connected = True
+    yield client
+    client.close()
+
@@ -0,0 +1,95 @@
+"""ConfigManager测试（配置文件写入临时目录）"""
+import json
+
+import pytest
+
+import config_manager
+from config_manager import ConfigManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """配置写入临时目录的配置管理器；延迟写入时间放大，由测试显式触发_flush"""
+    monkeypatch.setattr(config_manager, "SAVE_DEBOUNCE_SECONDS", 60)
+    cm = ConfigManager()
+    cm.config_path = str(tmp_path / "config.json")
+    cm.config = {"devices_triple": [{"device_id": "a"}, {"device_id": "b", "enabled": False}]}
+    yield cm
+    cm._flush()
+
+
+# ---------- 延迟合并保存 ----------
+
+def test_save_config_is_debounced(manager, tmp_path):
+    manager.save_config()
+    timer = manager._flush_timer
+    manager.config["mqtt_config"] = {"host": "h"}
+    manager.save_config()
+
+    assert manager._flush_timer is timer  # 多次保存只启动一个定时器
+    assert not (tmp_path / "config.json").exists()
+
+    manager._flush()
+    assert manager._flush_timer is None
+    assert json.loads((tmp_path / "config.json").read_text(encoding="utf-8"))["mqtt_config"] == {"host": "h"}
+
+
+def test_flush_replaces_file_atomically(manager, tmp_path, monkeypatch):
+    replaced = []
+    real_replace = config_manager.os.replace
+    monkeypatch.setattr(config_manager.os, "replace",
+                        lambda src, dst: replaced.append((src, dst)) or real_replace(src, dst))
+    manager.save_config()
+    manager._flush()
+
+    assert replaced == [(f"{manager.config_path}.tmp", manager.config_path)]
+    assert not (tmp_path / "config.json.tmp").exists()
+
+
+def test_flush_fsyncs_before_replace(manager, monkeypatch):
+    calls = []
+    real_fsync, real_replace = config_manager.os.fsync, config_manager.os.replace
+    monkeypatch.setattr(config_manager.os, "fsync", lambda fd: calls.append("fsync") or real_fsync(fd))
+    monkeypatch.setattr(config_manager.os, "replace",
+                        lambda src, dst: calls.append("replace") or real_replace(src, dst))
+    manager.save_config()
+    manager._flush()
+
+    assert calls == ["fsync", "replace"]
+
+
+def test_flush_skips_unchanged_content(manager, monkeypatch):
+    manager.save_config()
+    manager._flush()
+    writes = []
+    monkeypatch.setattr(config_manager.os, "replace", lambda src, dst: writes.append(dst))
+    manager.save_config()
+    manager._flush()
+
+    assert writes == []
+
+
+# ---------- 启用设备缓存 ----------
+
+def test_enabled_devices_are_copies(manager):
+    devices = manager.get_all_enabled_devices()
+    assert devices == [{"device_id": "a"}]
+
+    devices[0]["supported_properties"] = ["voltage"]
+    assert manager.get_all_enabled_devices() == [{"device_id": "a"}]
+    assert manager.config["devices_triple"][0] == {"device_id": "a"}
+
+
+def test_device_triple_is_copy(manager):
+    device = manager.get_device_triple("a")
+    device["device_secret"] = "changed"
+
+    assert manager.get_device_triple("a") == {"device_id": "a"}
+    assert manager.get_device_triple("b") is None  # 未启用的设备
+
+
+def test_device_cache_invalidated_on_update(manager):
+    manager.get_all_enabled_devices()
+    manager.update_device_triple("b", {"enabled": True})
+    assert [d["device_id"] for d in manager.get_all_enabled_devices()] == ["a", "b"]
+    assert manager.get_device_triple("b")["enabled"] is True
@@ -0,0 +1,144 @@
+"""HADiscovery测试（模拟HA会话，不访问真实HA）"""
+import json
+from unittest import mock
+
+import pytest
+
+from device_discovery import ha_discovery
+from device_discovery.ha_discovery import HADiscovery
+
+
+STATES = [
+    {"entity_id": "switch.cuco_v3_3e0a_on_p_2_1", "state": "on"},
+    {"entity_id": "sensor.cuco_v3_3e0a_voltage_p_11_2", "state": "220.5"},
+    {"entity_id": "sensor.cuco_v3x_9f01_voltage_p_11_2", "state": "221.0"},
+    {"entity_id": "sensor.cuco_v3_9f01_current_p_11_1", "state": "0.4"},
+    {"entity_id": "light.cuco_v3_3e0a_indicator", "state": "off"},
+    {"entity_id": "sensor.outdoor_temperature", "state": "18"},
+]
+
+
+def states_response(states, status_code=200):
+    """模拟/states接口的响应（支持with语句）"""
+    resp = mock.MagicMock(status_code=status_code, content=json.dumps(states).encode())
+    resp.__enter__.return_value = resp
+    return resp
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    """已通过模拟会话加载STATES的发现实例（整体解析响应体）"""
+    monkeypatch.setattr(ha_discovery, "ijson", None)
+    hd = HADiscovery({"ha_url": "http://supervisor/core/api"}, {})
+    hd._session = mock.Mock()
+    hd._session.get.return_value = states_response(STATES)
+    assert hd.load_ha_entities()
+    return hd
+
+
+def brute_force_match(hd, prefix):
+    """逐个实体判断的基准结果"""
+    entities = hd._entities
+    return [(i, c.partition(prefix)[2]) for i, c in zip(entities.ids, entities.cores) if prefix in c]
+
+
+# ---------- 实体加载与分词索引 ----------
+
+def test_load_keeps_only_discovery_domains(discovery):
+    ids = discovery._entities.ids
+    assert "light.cuco_v3_3e0a_indicator" not in ids
+    assert discovery._entity_states["sensor.cuco_v3_3e0a_voltage_p_11_2"] == "220.5"
+    assert len(ids) == 5
+
+
+def test_candidate_entities_narrow_by_inner_token(discovery):
+    ids = discovery._entities.ids
+    candidates = discovery._entities.candidates("cuco_v3_3e0a")
+    assert len(candidates) < len(ids)
+    assert {ids[i] for i in candidates} >= {i for i, _ in brute_force_match(discovery, "cuco_v3_3e0a")}
+
+
+@pytest.mark.parametrize("prefix", ["cuco_v3_3e0a", "cuco_v3_9f01", "cuco_v3x_9f01", "cuco_v3", "outdoor", "missing_x_y"])
+def test_match_prefix_equals_full_scan(discovery, prefix):
+    assert discovery._match_prefix(prefix) == brute_force_match(discovery, prefix)
+
+
+
+def test_reload_replaces_columns_and_index_together(discovery):
+    before = discovery._entities
+    discovery._session.get.return_value = states_response(STATES[3:])
+    assert discovery.load_ha_entities()
+
+    entities = discovery._entities
+    assert len(before.ids) == 5  # 旧快照保持不变，仍可被正在进行的发现使用
+    assert len(entities.ids) == 2
+    assert all(i < len(entities.cores) for bucket in entities.index.values() for i in bucket)
+    assert discovery._match_prefix("cuco_v3_9f01") == brute_force_match(discovery, "cuco_v3_9f01")
+
+
+def test_load_closes_failed_responses(monkeypatch):
+    monkeypatch.setattr(ha_discovery.time, "sleep", lambda seconds: None)
+    bad = states_response([], status_code=500)
+    bad.raise_for_status.side_effect = ha_discovery.requests.exceptions.HTTPError("500")
+    hd = HADiscovery({"ha_url": "http://supervisor/core/api", "retry_attempts": 2}, {})
+    hd._session = mock.Mock()
+    hd._session.get.return_value = bad
+
+    assert not hd.load_ha_entities()
+    assert bad.close.call_count == 2
+
+
+# ---------- 批量前缀匹配 ----------
+
+PREFIX_SETS = [
+    ("cuco_v3_3e0a", "cuco_v3_9f01"),
+    ("cuco_v3", "cuco_v3_3e0a", "cuco_v3x_9f01"),  # 一个前缀包含另一个
+    ("cuco_v3_3e0a", "missing_x_y"),
+]
+
+
+@pytest.mark.parametrize("use_automaton", [True, False])
+@pytest.mark.parametrize("prefixes", PREFIX_SETS)
+def test_match_prefixes_equals_per_prefix_match(discovery, monkeypatch, prefixes, use_automaton):
+    if use_automaton:
+        pytest.importorskip("ahocorasick")
+    else:
+        monkeypatch.setattr(ha_discovery, "ahocorasick", None)
+    matches = discovery._match_prefixes(prefixes)
+    assert matches == {prefix: brute_force_match(discovery, prefix) for prefix in prefixes}
+
+
+def test_match_prefixes_assigns_entity_to_every_overlapping_prefix(discovery):
+    matches = discovery._match_prefixes(["cuco_v3", "cuco_v3_3e0a"])
+    voltage = "sensor.cuco_v3_3e0a_voltage_p_11_2"
+    assert (voltage, "_3e0a_voltage_p_11_2") in matches["cuco_v3"]
+    assert (voltage, "_voltage_p_11_2") in matches["cuco_v3_3e0a"]
+
+
+def test_discover_batch_uses_bulk_prefix_match(discovery, monkeypatch):
+    seen = []
+    monkeypatch.setattr(discovery, "_build_device_result",
+                        lambda config, matches: seen.append((config["device_id"], matches)) or None)
+    discovery._discover_batch([
+        {"device_id": "a", "entity_prefix": "cuco_v3_3e0a"},
+        {"device_id": "b", "entity_prefix": "cuco_v3_9f01"},
+    ])
+    assert seen == [
+        ("a", brute_force_match(discovery, "cuco_v3_3e0a")),
+        ("b", brute_force_match(discovery, "cuco_v3_9f01")),
+    ]
+
+
+def test_discover_batch_isolates_invalid_prefixes(discovery):
+    matched = discovery._discover_batch([
+        {"device_id": "good", "entity_prefix": "cuco_v3_3e0a", "supported_properties": ["voltage"]},
+        {"device_id": "none", "entity_prefix": None},
+        {"device_id": "missing"},
+    ])
+    assert list(matched) == ["good"]
+    assert set(discovery.failed_devices) == {"none", "missing"}
+
+
+def test_missing_ha_url_does_not_raise():
+    hd = HADiscovery({}, {})
+    assert hd._states_url == "/states"
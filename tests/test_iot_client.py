@@ -0,0 +1,210 @@
+"""NeteaseIoTClient测试（模拟paho客户端，不建立真实连接）"""
+import json
+import logging
+from unittest import mock
+
+from iot_push import iot_client as iot_client_module
+from iot_push.iot_client import (
+    OUTBOX_REPLY_TTL_SECONDS,
+    PUBLISH_QUEUED,
+    PUBLISH_SENT,
+    PUBLISH_SKIPPED,
+    RECONNECT_JITTER_SECONDS,
+)
+
+
+SUB_TOPIC = "sys/sub_pk/sub_dn/event/property/post"
+REPLY_TOPIC = "sys/sub_pk/sub_dn/service/CommonService_reply"
+SUBDEVICE = {"device_id": "socket", "product_key": "sub_pk", "device_name": "sub_dn"}
+
+
+def published_topics(paho_client):
+    """按发布顺序返回模拟paho客户端收到的topic"""
+    return [c.args[0] for c in paho_client.publish.call_args_list]
+
+
+def published_params(paho_client):
+    """按发布顺序返回模拟paho客户端收到的属性上报params"""
+    return [json.loads(c.args[1])["params"] for c in paho_client.publish.call_args_list]
+
+
+# ---------- 断线暂存与补发 ----------
+
+def test_publish_while_disconnected_is_queued(iot_client, paho_client):
+    iot_client.connected = False
+    assert iot_client._publish_property({"voltage": 220}, SUB_TOPIC) == PUBLISH_QUEUED
+    assert len(iot_client._outbox) == 1
+    paho_client.publish.assert_not_called()
+
+
+def test_flush_outbox_replays_in_order(iot_client, paho_client):
+    iot_client.connected = False
+    iot_client._publish_property({"voltage": 220}, SUB_TOPIC)
+    iot_client._publish_reply("cmd-1", 200, None, REPLY_TOPIC)
+    iot_client._publish_property({"state0": 1}, iot_client.topic_property_post)
+
+    iot_client.connected = True
+    iot_client._flush_outbox()
+
+    assert published_topics(paho_client) == [SUB_TOPIC, REPLY_TOPIC, iot_client.topic_property_post]
+    assert not iot_client._outbox
+
+
+def test_flush_outbox_drops_gateway_posts_before_resync(iot_client, paho_client):
+    iot_client.connected = False
+    iot_client._publish_property({"state0": 1}, iot_client.topic_property_post)
+    iot_client._publish_property({"voltage": 220}, SUB_TOPIC)
+
+    iot_client.connected = True
+    iot_client._flush_outbox(resync=True)
+
+    assert published_topics(paho_client) == [SUB_TOPIC]
+
+
+def test_flush_outbox_drops_expired_replies(iot_client, paho_client):
+    iot_client.connected = False
+    iot_client._publish_reply("cmd-old", 200, None, REPLY_TOPIC)
+    iot_client._publish_reply("cmd-new", 200, None, REPLY_TOPIC)
+    topic, payload, is_reply, queued_at = iot_client._outbox[0]
+    iot_client._outbox[0] = (topic, payload, is_reply, queued_at - OUTBOX_REPLY_TTL_SECONDS - 1)
+
+    iot_client.connected = True
+    iot_client._flush_outbox()
+
+    payloads = [c.args[1] for c in paho_client.publish.call_args_list]
+    assert len(payloads) == 1
+    assert b"cmd-new" in payloads[0]
+
+
+def test_on_connect_flushes_outbox(iot_client, paho_client):
+    iot_client.sync_on_reconnect = False
+    iot_client.connected = False
+    iot_client._publish_property({"voltage": 220}, SUB_TOPIC)
+
+    iot_client._on_connect(paho_client, None, {}, 0)
+
+    assert iot_client.connected
+    assert published_topics(paho_client) == [SUB_TOPIC]
+    assert iot_client._publish_property({"voltage": 221}, SUB_TOPIC) == PUBLISH_SENT
+
+
+# ---------- 重连 ----------
+
+def test_reconnect_worker_waits_delay_plus_jitter(iot_client, monkeypatch):
+    uniform_calls = []
+    monkeypatch.setattr(iot_client_module.random, "uniform",
+                        lambda a, b: uniform_calls.append((a, b)) or b)
+    waits = []
+    closed = mock.Mock()
+    closed.is_set.return_value = False
+    closed.wait.side_effect = lambda timeout: waits.append(timeout) or True  # 返回True使工作线程退出
+    iot_client._closed = closed
+    iot_client.reconnect_delay = 4
+
+    iot_client._reconnect_event.set()
+    iot_client._reconnect_worker()
+
+    assert uniform_calls == [(0, RECONNECT_JITTER_SECONDS)]
+    assert waits == [4 + RECONNECT_JITTER_SECONDS]
+
+
+def test_reconnect_schedule_logging_is_rate_limited(iot_client, caplog):
+    iot_client._reconnect_thread = mock.Mock(is_alive=mock.Mock(return_value=True))  # 不启动真实的重连线程
+    iot_client.max_reconnect = 100
+    caplog.set_level(logging.INFO, logger=iot_client.logger.name)
+
+    logged_at = []
+    for attempt in range(1, 11):
+        caplog.clear()
+        iot_client._schedule_reconnect()
+        if any("尝试重连" in r.getMessage() for r in caplog.records):
+            logged_at.append(attempt)
+
+    assert logged_at == [1, 2, 4, 8]
+    assert iot_client._reconnect_attempts == 10
+
+
+def test_reconnect_attempts_reset_on_connect(iot_client, paho_client):
+    iot_client.sync_on_reconnect = False
+    iot_client._reconnect_attempts = 5
+    iot_client._on_connect(paho_client, None, {}, 0)
+    assert iot_client._reconnect_attempts == 0
+    assert iot_client._reconnect_log_enabled()
+
+
+# ---------- 子设备属性增量推送 ----------
+
+def test_subdevice_push_sends_only_changed_properties(iot_client, paho_client):
+    first = iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0, "current": 0.5})
+    second = iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0, "current": 0.7})
+
+    assert (first, second) == (PUBLISH_SENT, PUBLISH_SENT)
+    assert published_params(paho_client) == [{"voltage": 220.0, "current": 0.5}, {"current": 0.7}]
+    assert published_topics(paho_client) == [SUB_TOPIC, SUB_TOPIC]
+
+
+def test_subdevice_push_skips_unchanged_data(iot_client, paho_client):
+    iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0})
+    assert iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0}) == PUBLISH_SKIPPED
+    assert paho_client.publish.call_count == 1
+
+
+def test_subdevice_push_always_sends_configured_keys(iot_client, paho_client):
+    iot_client.always_push_keys = frozenset({"energy"})
+    iot_client.push_subdevice_property(SUBDEVICE, {"energy": 1.5, "voltage": 220.0})
+    iot_client.push_subdevice_property(SUBDEVICE, {"energy": 1.5, "voltage": 220.0})
+
+    assert published_params(paho_client) == [{"energy": 1.5, "voltage": 220.0}, {"energy": 1.5}]
+
+
+def test_subdevice_push_baseline_resets_on_connect(iot_client, paho_client):
+    iot_client.sync_on_reconnect = False
+    iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0})
+    iot_client._on_connect(paho_client, None, {}, 0)
+
+    assert iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0}) == PUBLISH_SENT
+    assert published_params(paho_client) == [{"voltage": 220.0}, {"voltage": 220.0}]
+
+
+def test_subdevice_push_baseline_is_per_device(iot_client, paho_client):
+    other = {"device_id": "socket2", "product_key": "sub_pk", "device_name": "sub_dn2"}
+    iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0})
+    assert iot_client.push_subdevice_property(other, {"voltage": 220.0}) == PUBLISH_SENT
+
+
+def test_subdevice_push_failure_keeps_baseline(iot_client, paho_client):
+    paho_client.publish.side_effect = lambda *args, **kwargs: mock.Mock(rc=iot_client_module.mqtt.MQTT_ERR_NO_CONN, mid=0)
+    iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0})
+    paho_client.publish.side_effect = lambda *args, **kwargs: mock.Mock(rc=iot_client_module.mqtt.MQTT_ERR_SUCCESS, mid=1)
+
+    assert iot_client.push_subdevice_property(SUBDEVICE, {"voltage": 220.0}) == PUBLISH_SENT
+
+
+# ---------- 未确认消息跟踪 ----------
+
+def test_inflight_not_tracked_above_debug(iot_client, caplog):
+    caplog.set_level(logging.INFO, logger=iot_client.logger.name)
+    assert iot_client._publish_property({"voltage": 220}, SUB_TOPIC) == PUBLISH_SENT
+    assert iot_client._inflight == {}
+
+
+def test_inflight_tracked_and_acked_at_debug(iot_client, paho_client, caplog):
+    caplog.set_level(logging.DEBUG, logger=iot_client.logger.name)
+    iot_client._publish_property({"voltage": 220}, SUB_TOPIC)
+    assert list(iot_client._inflight) == [1]
+
+    iot_client._on_publish(paho_client, None, 1)
+    assert iot_client._inflight == {}
+
+
+# ---------- 客户端初始化 ----------
+
+def test_init_mqtt_client_does_not_log_password(iot_client, monkeypatch, caplog):
+    monkeypatch.setattr(iot_client, "_generate_mqtt_password", lambda: "v1:SECRETTOKEN")
+    iot_client.client = None
+    caplog.set_level(logging.DEBUG, logger=iot_client.logger.name)
+
+    iot_client._init_mqtt_client()
+
+    assert iot_client.client is not None
+    assert all("SECRETTOKEN" not in r.getMessage() for r in caplog.records)